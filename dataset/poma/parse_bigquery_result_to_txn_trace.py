@@ -1,7 +1,11 @@
 import os
-import json
+import sys
 import time
 
+# Add the repository's src folder to the path for the shared JSON codec.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+import json_codec
+
 # Configuration for input and output paths
 INPUT_FILE = 'poma_raw_input_bigquery.jsonl'
 OUTPUT_DIR = 'trace_poma'
@@ -28,8 +32,8 @@ with open(INPUT_FILE, 'r') as infile:
 
         try:
             # Parse the JSON line
-            record = json.loads(line)
-        except json.JSONDecodeError:
+            record = json_codec.loads(line)
+        except json_codec.DecodeError:
             # If the record cannot be parsed, skip it
             continue
 
@@ -50,8 +54,7 @@ total_transactions = len(traces_by_transaction)
 # Write individual JSON files in pretty print format (indentation = 2 spaces)
 for tx_hash, call_traces in traces_by_transaction.items():
     output_filename = os.path.join(OUTPUT_DIR, f'{tx_hash}.json')
-    with open(output_filename, 'w') as outfile:
-        json.dump(call_traces, outfile, indent=2)
+    json_codec.dump(call_traces, output_filename, indent=2)
 
 # Calculate processing time and average number of traces per transaction
 processing_time = time.time() - start_time
@@ -1,8 +1,12 @@
 import os
+import sys
 import csv
-import json
 import time
 
+# Add the repository's src folder to the path for the shared JSON codec.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+import json_codec
+
 # Input file and output directory configuration
 INPUT_FILE = 'reentrancy_raw_input_bigquery.csv'
 OUTPUT_DIR = 'trace_reentrancy'
@@ -42,8 +46,7 @@ total_transactions = len(traces_by_transaction)
 # The output is pretty printed with indent=2
 for tx_hash, call_traces in traces_by_transaction.items():
     output_file = os.path.join(OUTPUT_DIR, f'{tx_hash}.json')
-    with open(output_file, 'w') as outfile:
-        json.dump(call_traces, outfile, indent=2)
+    json_codec.dump(call_traces, output_file, indent=2)
 
 # Calculate total processing time and the average number of traces per transaction
 processing_time = time.time() - start_time
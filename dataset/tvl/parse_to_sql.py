@@ -1,5 +1,10 @@
-import json
+import os
 import re
+import sys
+
+# Add the repository's src folder to the path for the shared JSON codec.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+import json_codec
 
 # Define a regular expression that matches an Ethereum contract address.
 eth_address_pattern = re.compile(r'0x[a-fA-F0-9]{40}')
@@ -93,12 +98,10 @@ WHERE t.transaction_hash IN (SELECT transaction_hash FROM selected_hashes)
 
 def process_json(input_filename, output_filename, exclude_filename, transactions_sql_filename, traces_sql_filename):
     # Load the source JSON data.
-    with open(input_filename, 'r') as infile:
-        data = json.load(infile)
+    data = json_codec.load(input_filename)
     
     # Load the exclusion JSON data.
-    with open(exclude_filename, 'r') as exfile:
-        exclude_data = json.load(exfile)
+    exclude_data = json_codec.load(exclude_filename)
     # Expecting the structure {"addresses": [ ... ]}
     if isinstance(exclude_data, dict) and "addresses" in exclude_data:
         exclude_list = exclude_data["addresses"]
@@ -139,8 +142,7 @@ def process_json(input_filename, output_filename, exclude_filename, transactions
     
     # Write the modified JSON data to the output file.
     output_data = {"data": new_data}
-    with open(output_filename, 'w') as outfile:
-        json.dump(output_data, outfile, indent=4)
+    json_codec.dump(output_data, output_filename)
     
     # Build the SQL query for the transactions table.
     transactions_sql_query = build_transactions_sql_query(all_contract_addresses)
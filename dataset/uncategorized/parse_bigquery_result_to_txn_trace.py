@@ -1,7 +1,11 @@
 import os
-import json
+import sys
 import time
 
+# Add the repository's src folder to the path for the shared JSON codec.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+import json_codec
+
 # Input and output configuration
 INPUT_FILE = 'uncategorized_attack_raw_input_bigquery.json'
 OUTPUT_DIR = 'trace_uncategorized'
@@ -18,8 +22,7 @@ traces_by_transaction = {}
 # Load the entire JSON list from the input file.
 # Note: This assumes the file can fit into memory. For extremely large files,
 # consider using a streaming parser like ijson.
-with open(INPUT_FILE, 'r') as infile:
-    data = json.load(infile)
+data = json_codec.load(INPUT_FILE)
 
 # Total trace counter
 total_traces = 0
@@ -45,9 +48,8 @@ total_transactions = len(traces_by_transaction)
 # For each transaction, write the list of call traces to a separate JSON file
 for tx_hash, call_traces in traces_by_transaction.items():
     output_filename = os.path.join(OUTPUT_DIR, f'{tx_hash}.json')
-    with open(output_filename, 'w') as outfile:
-        # Write the JSON data with pretty-print formatting (indentation = 2 spaces)
-        json.dump(call_traces, outfile, indent=2)
+    # Write the JSON data with pretty-print formatting (indentation = 2 spaces)
+    json_codec.dump(call_traces, output_filename, indent=2)
 
 # Calculate processing time and average number of traces per transaction
 processing_time = time.time() - start_time
@@ -3,7 +3,7 @@ from hex_decoder import hex_to_function_name
 from utils import find_element_by_address, split_signature, build_tree
 from parser import extract_function, extract_event, merge_events_functions
 from jinja2 import Template
-import json
+import json_codec
 import os
 import logging
 import argparse
@@ -26,15 +26,13 @@ def read_json_file(file_path):
             logging.warning(f"File not found: {file_path}")
             return None
 
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        return data
+        return json_codec.load(file_path)
 
     except FileNotFoundError:
         logging.warning(f"File not found: {file_path}")
         return None
 
-    except json.JSONDecodeError:
+    except json_codec.DecodeError:
         logging.error(f"Error decoding JSON from the file: {file_path}")
         return None
 
@@ -86,12 +84,12 @@ def main(
     merged_tree, unmatched, total_nodes, name_match, total_ignored = merge_events_functions(
         processed_event, total_nodes, name_match, processed_data, total_ignored ,output_path)
 
-    unmatched_node = json.dumps(unmatched, indent=4)
+    unmatched_node = json_codec.dumps(unmatched)
 
     orphaned_path = f'{output_path}/orphaned/{transaction_hash}_orphaned.json'
     stat_path = f'{output_path}/stats/{transaction_hash}_stat.json'
     
-    with open(orphaned_path, 'w') as file:
+    with open(orphaned_path, 'w', encoding='utf-8') as file:
         file.write(unmatched_node)
     logger.debug(f'Orphaned events write to {orphaned_path}')
 
@@ -112,8 +110,7 @@ def main(
         "ignore_rate": ignore_rate
         
     }
-    with open(stat_path, "w") as json_file:
-        json.dump(stats, json_file, indent=4)
+    json_codec.dump(stats, stat_path)
         
     #modify the structure here to add in the parameters and process the parameters
     for row in merged_tree:
@@ -136,10 +133,10 @@ def main(
         
         root_node['nodes'] = build_tree(merged_tree)['nodes']
 
-        json_tree = json.dumps(root_node, indent=4)
+        json_tree = json_codec.dumps(root_node)
 
     json_tree_path = f"{output_path}/actiontree/{transaction_hash}.json"
-    with open(json_tree_path, 'w') as file:
+    with open(json_tree_path, 'w', encoding='utf-8') as file:
         file.write(json_tree)
     logger.debug(f'Action tree write to {json_tree_path}')
 
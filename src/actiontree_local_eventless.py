@@ -1,10 +1,10 @@
 import sys
 import os
-import json
+import json_codec
 import logging
 import argparse
 from hex_decoder import hex_to_function_name
-from selector_decoder import decode_selector
+from selector_decoder import decode_selector, find_unresolved_selectors
 from utils import find_element_by_address, split_signature, build_tree
 from parser import extract_function, extract_event, merge_events_functions
 from jinja2 import Template
@@ -27,15 +27,13 @@ def read_json_file(file_path):
             logging.warning(f"File not found: {file_path}")
             return None
 
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        return data
+        return json_codec.load(file_path)
 
     except FileNotFoundError:
         logging.warning(f"File not found: {file_path}")
         return None
 
-    except json.JSONDecodeError:
+    except json_codec.DecodeError:
         logging.error(f"Error decoding JSON from the file: {file_path}")
         return None
 
@@ -63,6 +61,7 @@ def main(trace_path, event_path, output_path, transaction_hash, event_input_path
     processed_data = extract_function(call_data, transaction_hash)
 
     decode_selector(processed_data)
+    unresolved_selectors = find_unresolved_selectors(processed_data)
 
     # hex_to_function_name(
     #     processed_data,
@@ -93,22 +92,34 @@ def main(trace_path, event_path, output_path, transaction_hash, event_input_path
             "Event path or event input path not provided, skipping event extraction.")
 
     # Merge the processed event and function (call) data into a single merged_tree.
+    # The ether/create/suicide flags are kept in the stats file; the batch script
+    # derives the *_count.json totals from them so that rebuilds are not counted twice.
+    counts = {}
     merged_tree, unmatched, total_nodes, name_match, total_ignored = merge_events_functions(
-        processed_event, total_nodes, name_match, processed_data, total_ignored, output_path)
+        processed_event, total_nodes, name_match, processed_data, total_ignored, output_path,
+        counts=counts)
 
-    unmatched_node = json.dumps(unmatched, indent=4)
+    unmatched_node = json_codec.dumps(unmatched)
     orphaned_path = os.path.join(
         output_path, 'orphaned', f'{transaction_hash}_orphaned.json')
     stat_path = os.path.join(output_path, 'stats',
                              f'{transaction_hash}_stat.json')
+    unresolved_path = os.path.join(
+        output_path, 'unresolved', f'{transaction_hash}_unresolved.json')
 
     os.makedirs(os.path.dirname(orphaned_path), exist_ok=True)
     os.makedirs(os.path.dirname(stat_path), exist_ok=True)
+    os.makedirs(os.path.dirname(unresolved_path), exist_ok=True)
 
-    with open(orphaned_path, 'w') as file:
+    with open(orphaned_path, 'w', encoding='utf-8') as file:
         file.write(unmatched_node)
     logger.debug(f'Orphaned events written to {orphaned_path}')
 
+    # Record selectors left undecoded so redecode_selectors.py can patch
+    # this tree once the selector database learns about them.
+    json_codec.dump(unresolved_selectors, unresolved_path)
+    logger.debug(f'Unresolved selectors written to {unresolved_path}')
+
     unmatched_num = total_nodes - name_match if total_nodes > 0 else 0
     missing_rate = round(unmatched_num / total_nodes *
                          100, 2) if total_nodes > 0 else 0
@@ -124,10 +135,10 @@ def main(trace_path, event_path, output_path, transaction_hash, event_input_path
         "total_missing": unmatched_num,
         "missing_rate": missing_rate,
         "total_ignored": total_ignored,
-        "ignore_rate": ignore_rate
+        "ignore_rate": ignore_rate,
+        "counts": counts
     }
-    with open(stat_path, "w") as json_file:
-        json.dump(stats, json_file, indent=4)
+    json_codec.dump(stats, stat_path)
 
     # Building the final action tree.
     root_node = None
@@ -152,12 +163,12 @@ def main(trace_path, event_path, output_path, transaction_hash, event_input_path
     if root_node is not None:
         tree_structure = build_tree(merged_tree)
         root_node['nodes'] = tree_structure.get('nodes', [])
-        json_tree = json.dumps(root_node, indent=4)
+        json_tree = json_codec.dumps(root_node)
 
         json_tree_path = os.path.join(
             output_path, 'actiontree', f'{transaction_hash}.json')
         os.makedirs(os.path.dirname(json_tree_path), exist_ok=True)
-        with open(json_tree_path, 'w') as file:
+        with open(json_tree_path, 'w', encoding='utf-8') as file:
             file.write(json_tree)
         logger.debug(f'Action tree written to {json_tree_path}')
     else:
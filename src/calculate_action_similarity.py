@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import json
+import json_codec
 import argparse
 import math
 import itertools
@@ -62,8 +62,7 @@ def main():
     args = parser.parse_args()
 
     # Read and load the JSON tree from the input file.
-    with open(args.input_file, 'r') as f:
-        tree = json.load(f)
+    tree = json_codec.load(args.input_file)
 
     print("Tree Visualization:\n")
     # Traverse the tree and collect the printed actions.
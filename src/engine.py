@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import logging
+import argparse
+import importlib.util
+from glob import glob
+from functools import partial
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+# The system detectors import their helpers (results, similarity, embedding_store) by flat name.
+sys.path.insert(0, os.path.join(SRC_DIR, 'system'))
+
+import json_codec
+from scheduler import run_forked, largest_first, file_size_or_zero
+from tree_loader import load_tree, run_prefetched, add_loader_arguments
+from sharding import in_shard, tx_hash_of, add_shard_arguments, check_shard_arguments
+from results import DetectionBudget, add_budget_arguments
+from embedding_store import Embedder, DEFAULT_STORE_PATH, prepare_forked_embedder, add_preload_arguments
+from similarity import name_table
+from traversal import walk_preorder
+
+
+def load_detector_module(name, relative_path):
+    """Import a detector script under a unique module name: system/ and moe/ both define poma and reentrancy."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SRC_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+system_reentrancy = load_detector_module("system_reentrancy", "system/reentrancy.py")
+system_poma = load_detector_module("system_poma", "system/poma.py")
+moe_reentrancy = load_detector_module("moe_reentrancy", "moe/reentrancy.py")
+moe_poma = load_detector_module("moe_poma", "moe/poma.py")
+
+# Per-node record functions of the call tables built during the single traversal of a tree.
+# The two system detectors record the same calls, so they share one table.
+CALL_TABLES = {
+    "system_calls": lambda node, order, depth, options: system_reentrancy.call_record(
+        node, order, depth, options["ignore_static_delegate"]),
+    "moe_calls": lambda node, order, depth, options: moe_reentrancy.call_record(node, order, depth),
+    "moe_transfers": lambda node, order, depth, options: moe_poma.transfer_record(node, order, depth),
+}
+
+
+def shared_name_table(context):
+    """The name table (and embeddings) of the system calls, built once per tree for both system detectors."""
+    if "name_table" not in context:
+        context["name_table"] = name_table(context["tables"]["system_calls"], context["embedder"])
+    return context["name_table"]
+
+
+def new_budget(context):
+    return DetectionBudget(context["options"]["max_seconds"], context["options"]["max_comparisons"])
+
+
+def verdict_of(detected, budget=None):
+    if detected:
+        return "detected"
+    if budget is not None and budget.exceeded:
+        return "budget_exceeded"
+    return "not_detected"
+
+
+def run_system_reentrancy(context):
+    budget = new_budget(context)
+    triples = system_reentrancy.detect_reentrancy(context["tables"]["system_calls"], mode="exists",
+                                                  budget=budget, table=shared_name_table(context),
+                                                  embedder=context["embedder"])
+    return verdict_of(bool(triples), budget)
+
+
+def run_system_poma(context):
+    budget = new_budget(context)
+    detected, _ = system_poma.detect_poma(context["tables"]["system_calls"], mode="exists",
+                                          budget=budget, table=shared_name_table(context),
+                                          embedder=context["embedder"])
+    return verdict_of(detected, budget)
+
+
+def run_moe_reentrancy(context):
+    detected, _ = moe_reentrancy.detect_reentrancy(context["tables"]["moe_calls"])
+    return verdict_of(detected)
+
+
+def run_moe_poma(context):
+    detected, _ = moe_poma.detect_price_manipulation(moe_poma.form_transacts(context["tables"]["moe_transfers"]))
+    return verdict_of(detected)
+
+
+# Registered detectors: name -> (call table it reads, function returning its verdict for a tree).
+DETECTORS = {
+    "system_reentrancy": ("system_calls", run_system_reentrancy),
+    "system_poma": ("system_calls", run_system_poma),
+    "moe_reentrancy": ("moe_calls", run_moe_reentrancy),
+    "moe_poma": ("moe_transfers", run_moe_poma),
+}
+
+
+def analyze_tree(tree, detectors, options, embedder):
+    """
+    Run the named detectors on one action tree, the system detectors embedding names with
+    embedder (an embedding_store.Embedder). The tree is traversed once, filling only
+    the call tables the detectors need, and is not modified. Returns {detector: verdict},
+    a verdict being "detected", "not_detected", "budget_exceeded" or "error".
+    """
+    tables = {DETECTORS[name][0]: [] for name in detectors}
+    for node, order, depth in walk_preorder(tree):
+        for table, records in tables.items():
+            record = CALL_TABLES[table](node, order, depth, options)
+            if record is not None:
+                records.append(record)
+
+    context = {"tables": tables, "options": options, "embedder": embedder}
+    verdicts = {}
+    for name in detectors:
+        try:
+            verdicts[name] = DETECTORS[name][1](context)
+        except Exception as e:
+            logging.error("Detector %s failed: %s", name, str(e))
+            verdicts[name] = "error"
+    return verdicts
+
+
+def analyze_file(file_path, detectors, options, embedder, tree=None):
+    """
+    Load one action tree (unless it is passed in, already loaded by a prefetching loader)
+    and return its combined verdict record.
+    """
+    start = time.perf_counter()
+    if tree is None:
+        tree = load_tree(file_path)
+    verdicts = analyze_tree(tree, detectors, options, embedder)
+    return {"tx_hash": tx_hash_of(file_path), "verdicts": verdicts, "seconds": round(time.perf_counter() - start, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run several detectors (system and MoE reentrancy/POMA) over action trees in a single pass per tree "
+                    "and emit one combined verdict record per transaction.")
+    parser.add_argument("--input-path", required=True, help="Folder path containing JSON files to process")
+    parser.add_argument("--detectors", nargs='+', choices=list(DETECTORS), default=list(DETECTORS),
+                        help="Detectors to run (default: all).")
+    parser.add_argument("--output-file", default=None,
+                        help="Write the combined verdict records as JSON lines.")
+    parser.add_argument("--ignore-static-delegate", action="store_true",
+                        help="Ignore nodes with 'staticcall' or 'delegatecall' in the system detectors.")
+    parser.add_argument("--embedding-store", default=DEFAULT_STORE_PATH,
+                        help="Pre-computed action-name embeddings (built with system/embedding_store.py).")
+    parser.add_argument("--order", choices=["listing", "largest-first"], default="listing",
+                        help="Process files in directory order or largest tree first.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of forked worker processes (default: 1, run in this process).")
+    add_preload_arguments(parser)
+    add_budget_arguments(parser)
+    add_loader_arguments(parser)
+    add_shard_arguments(parser)
+    args = parser.parse_args()
+    check_shard_arguments(parser, args)
+
+    uses_embeddings = any(DETECTORS[name][0] == "system_calls" for name in args.detectors)
+    embedder = Embedder.from_path(args.embedding_store)
+    if uses_embeddings:
+        prepare_forked_embedder(embedder, args.workers, preload=not args.no_preload_model)
+
+    file_paths = [file_path for file_path in glob(os.path.join(args.input_path, "*.json"))
+                  if in_shard(tx_hash_of(file_path), args.shard_index, args.num_shards)]
+    if args.order == "largest-first":
+        file_paths = largest_first(file_paths, file_size_or_zero)
+
+    options = {
+        "ignore_static_delegate": args.ignore_static_delegate,
+        "max_seconds": args.max_seconds,
+        "max_comparisons": args.max_comparisons,
+    }
+    counts = {name: {} for name in args.detectors}
+    output = open(args.output_file, "w", encoding="utf-8") if args.output_file else None
+    try:
+        analyze = partial(analyze_file, detectors=args.detectors, options=options, embedder=embedder)
+        if args.workers > 1:
+            # Records are written in file order, so the output does not depend on the worker count.
+            outcomes = run_forked(analyze, file_paths, args.workers, total=len(file_paths),
+                                  desc="Processing JSON files", unit="file", ordered=True)
+        else:
+            # In-process: the next trees are read and decoded while the detectors run on this one.
+            outcomes = run_prefetched(analyze, file_paths, args.prefetch_depth, args.loader_threads,
+                                      total=len(file_paths), desc="Processing JSON files", unit="file")
+        for file_path, record, error in outcomes:
+            if error is not None:
+                logging.error("Error processing file %s: %s", file_path, str(error))
+                record = {"tx_hash": tx_hash_of(file_path), "verdicts": {name: "error" for name in args.detectors}}
+            for name, verdict in record["verdicts"].items():
+                counts[name][verdict] = counts[name].get(verdict, 0) + 1
+            if output is not None:
+                output.write(json_codec.dumps(record, indent=None) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+
+    print("\n=== Processing Completed ===")
+    print(f"Total JSON files processed: {len(file_paths)}")
+    for name, verdict_counts in counts.items():
+        summary = ", ".join(f"{verdict}: {count}" for verdict, count in sorted(verdict_counts.items()))
+        print(f"  - {name}: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
 import numpy as np
 import pandas as pd
-import json
+import json_codec
 
 def process_json(input_json_path, transactions, output_json_path):
     
-    with open(input_json_path, 'r') as f:
-        data = json.load(f)
+    data = json_codec.load(input_json_path)
     
     #i= 0
     for sample, points in data.items():
@@ -21,8 +20,7 @@ def process_json(input_json_path, transactions, output_json_path):
                     points[i] = matched_transaction
                     i=i+1"""
 
-    with open(output_json_path, 'w') as f:
-        json.dump(data, f, indent=4)
+    json_codec.dump(data, output_json_path)
 
 def read_transactions(file_path):
     transactions = []
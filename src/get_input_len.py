@@ -1,4 +1,4 @@
-import json
+import json_codec
 import os
 import argparse
 
@@ -14,8 +14,7 @@ def extract_values_raw_lengths(data, lengths):
        
 
 def read_hashes_from_json(file_path):
-    with open(file_path, 'r') as file:
-        data = json.load(file)
+    data = json_codec.load(file_path)
         
     hash_list = [item['transaction_hash'] for item in data]
     
@@ -30,8 +29,7 @@ def main(actiontree_path, hash_path, output_path):
     for hash in hash_list:
         file_path = f'{actiontree_path}/{hash}.json'
         
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+        data = json_codec.load(file_path)
         
         lengths = []
         extract_values_raw_lengths(data, lengths)
@@ -45,8 +43,7 @@ def main(actiontree_path, hash_path, output_path):
         }
         
         output_file = f'{result_path}/{hash}.json'
-        with open(output_file, 'w') as f:
-            json.dump(result, f, indent=4)
+        json_codec.dump(result, output_file)
 
     
     
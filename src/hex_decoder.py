@@ -1,5 +1,5 @@
 import requests
-import json
+import json_codec
 import os
 from filelock import FileLock
 from datetime import datetime
@@ -19,16 +19,14 @@ def get_timestamp():
 def read_json(file_path):
 
     if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            return json.load(file)
+        return json_codec.load(file_path)
     return {}
 
 
 def write_json(file_path,
                data):
 
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+    json_codec.dump(data, file_path)
 
 
 def update_hex_mapping(hex_data,
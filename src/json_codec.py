@@ -0,0 +1,142 @@
+import os
+import json
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Backends in order of preference: the first installed one is used unless
+# JSON_BACKEND names another. The stdlib json is always available.
+BACKENDS = ["orjson", "ujson", "json"]
+
+# Indentation of pretty-printed files, as the stages have always written them.
+DEFAULT_INDENT = 4
+
+# Raised by loads/load on malformed input, whatever the backend.
+DecodeError = json.JSONDecodeError
+
+# Integer literals beyond the 64-bit range (below -2**63 or above 2**64 - 1)
+# would be decoded as floats by orjson (and possibly ujson), silently rounding
+# token amounts, so any document that may contain one is decoded with the stdlib
+# json instead. Conservatively, that is any integer of 20+ digits, or of 19+
+# digits after a minus sign. To find them at memory speed, digits are mapped to
+# "0", "-" to itself, other bytes that can precede a number to " " and
+# everything else (e.g. the "x" of hex strings) to "x".
+_NUMBER_TABLE = bytes(ord("0") if chr(byte) in "0123456789" else byte if chr(byte) == "-"
+                      else ord(" ") if chr(byte) in " \t\r\n:[," else ord("x")
+                      for byte in range(256))
+_LONG_INTEGER = b" " + b"0" * 20
+_LONG_NEGATIVE = b"-" + b"0" * 19
+
+
+def _has_long_integer(raw):
+    numbers = raw.translate(_NUMBER_TABLE)
+    # A bare top-level number has no preceding byte.
+    return (_LONG_INTEGER in numbers or _LONG_NEGATIVE in numbers
+            or numbers.startswith(_LONG_INTEGER[1:]))
+
+
+def _has_non_finite(obj):
+    # orjson writes NaN and +/-Infinity as null instead of failing, so such
+    # objects must be encoded by the stdlib json to round-trip unchanged.
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, float) and not math.isfinite(value):
+            return True
+    return False
+
+
+def _installed(name):
+    return {"orjson": orjson, "ujson": ujson, "json": json}[name] is not None
+
+
+def _pick_backend(name=None):
+    if name and name != "auto":
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown JSON backend {name!r}; choose from {', '.join(BACKENDS)}")
+        if not _installed(name):
+            raise ValueError(f"JSON backend {name!r} is not installed")
+        return name
+    return next(name for name in BACKENDS if _installed(name))
+
+
+# Process-wide settings, read from the environment so that every stage (and
+# every worker it starts) encodes the same way; override them with configure().
+_backend = _pick_backend(os.environ.get("JSON_BACKEND"))
+_compact = os.environ.get("JSON_COMPACT", "").lower() in {"1", "true", "yes"}
+
+
+def configure(backend=None, compact=None):
+    """
+    Select the JSON backend ("orjson", "ujson", "json" or "auto") and/or
+    whether writers drop indentation (compact) for this process.
+    """
+    global _backend, _compact
+    if backend is not None:
+        _backend = _pick_backend(backend)
+    if compact is not None:
+        _compact = compact
+
+
+def backend_name():
+    return _backend
+
+
+def loads(data):
+    """Decode a JSON document given as str or bytes."""
+    raw = data.encode() if isinstance(data, str) else data
+    if _backend != "json" and not _has_long_integer(raw):
+        try:
+            return orjson.loads(raw) if _backend == "orjson" else ujson.loads(raw)
+        except ValueError:
+            # NaN/Infinity and other inputs the stdlib accepts; it also reports the error if any.
+            pass
+    return json.loads(raw)
+
+
+def dumps(obj, indent=DEFAULT_INDENT):
+    """
+    Encode obj as a JSON string, indented by `indent` spaces unless indent is
+    None or compact output is configured. orjson can only indent by 2, so it
+    is used for compact and 2-space output only and files keep their format.
+    Objects the fast backend cannot encode faithfully (integers beyond 64
+    bits, NaN and infinities) are encoded with the stdlib json.
+    """
+    if _compact:
+        indent = None
+    try:
+        if _backend == "orjson" and indent in (None, 2) and not _has_non_finite(obj):
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+            return orjson.dumps(obj, option=option).decode()
+        if _backend == "ujson":
+            return ujson.dumps(obj, indent=indent or 0, escape_forward_slashes=False)
+    except (TypeError, OverflowError):
+        pass
+    if indent is None:
+        return json.dumps(obj, separators=(",", ":"))
+    return json.dumps(obj, indent=indent)
+
+
+def load(file_path):
+    """Read and decode a JSON file."""
+    with open(file_path, "rb") as file:
+        return loads(file.read())
+
+
+def dump(obj, file_path, indent=DEFAULT_INDENT):
+    """Encode obj (see dumps) and write it to file_path."""
+    # orjson and ujson write non-ASCII characters unescaped, so the file must
+    # be UTF-8 whatever the locale.
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(dumps(obj, indent))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import os
+import json_codec
+import shutil
+import argparse
+from tqdm import tqdm
+from hex_decoder import read_json, write_json
+from parsing_tree_eventless import MANIFEST_FILE, SHARD_FILE, COUNT_FILES, load_manifest, write_counts
+
+OUTPUT_SUBDIRS = ['actiontree', 'orphaned', 'stats', 'unresolved']
+
+
+def merge_builds(shard_paths, output_path):
+    """
+    Merge the output folders of parsing_tree_eventless.py shard runs.
+    Fails if a shard is missing or duplicated, or if a transaction was built
+    by two shards, so the merged folder equals that of a single unsharded run.
+    Per-transaction files are copied as is, manifests concatenated and the
+    counters recomputed from the merged manifest.
+    """
+    shards = []
+    for shard_path in shard_paths:
+        shard = read_json(os.path.join(shard_path, SHARD_FILE))
+        if not shard:
+            raise ValueError(f"{shard_path} has no {SHARD_FILE}; was it built by parsing_tree_eventless.py?")
+        shards.append(shard)
+
+    num_shards = {shard['num_shards'] for shard in shards}
+    shard_indexes = sorted(shard['shard_index'] for shard in shards)
+    if len(num_shards) != 1 or shard_indexes != list(range(num_shards.pop())):
+        raise ValueError(f"Incomplete or inconsistent shard set: {shard_indexes}")
+
+    records = {}
+    for shard_path in shard_paths:
+        shard_records = load_manifest(os.path.join(shard_path, MANIFEST_FILE))
+        overlap = records.keys() & shard_records.keys()
+        if overlap:
+            raise ValueError(f"{len(overlap)} transactions appear in more than one shard")
+        records.update(shard_records)
+
+    # Check every file before copying any, so a bad shard set leaves output_path untouched.
+    copies = {}
+    for subdir in OUTPUT_SUBDIRS:
+        for shard_path in shard_paths:
+            src_dir = os.path.join(shard_path, subdir)
+            if not os.path.isdir(src_dir):
+                continue
+            for filename in os.listdir(src_dir):
+                dst_file = os.path.join(output_path, subdir, filename)
+                if dst_file in copies:
+                    raise ValueError(f"{subdir}/{filename} appears in more than one shard")
+                copies[dst_file] = os.path.join(src_dir, filename)
+
+    for subdir in OUTPUT_SUBDIRS:
+        os.makedirs(os.path.join(output_path, subdir), exist_ok=True)
+    for dst_file, src_file in tqdm(copies.items(), desc="Merging shards", unit="file"):
+        shutil.copy2(src_file, dst_file)
+
+    with open(os.path.join(output_path, MANIFEST_FILE), 'w') as outfile:
+        for shard_path in shard_paths:
+            manifest_path = os.path.join(shard_path, MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r') as infile:
+                    last = '\n'
+                    for chunk in iter(lambda: infile.read(1 << 20), ''):
+                        outfile.write(chunk)
+                        last = chunk[-1]
+                # Terminate a truncated last line so the next shard's first record survives.
+                if last != '\n':
+                    outfile.write('\n')
+
+    write_json(os.path.join(output_path, SHARD_FILE), {'shard_index': 0, 'num_shards': 1})
+    write_counts(output_path, records)
+    for fname in COUNT_FILES.values():
+        print(f"{fname}: {read_json(os.path.join(output_path, fname))['count']}")
+
+
+def merge_verdicts(result_files, output_file):
+    """
+    Merge the --results-file outputs of a sharded harness run.
+    Fails if a shard is missing or a transaction was processed by two shards,
+    so the merged totals equal those of a single unsharded run.
+    """
+    records = []
+    for result_file in result_files:
+        records.append(json_codec.load(result_file))
+
+    num_shards = {record['num_shards'] for record in records}
+    shard_indexes = sorted(record['shard_index'] for record in records)
+    if len(num_shards) != 1 or shard_indexes != list(range(num_shards.pop())):
+        raise ValueError(f"Incomplete or inconsistent shard set: {shard_indexes}")
+
+    merged = {}
+    seen = set()
+    for record in records:
+        for name, hashes in record['verdicts'].items():
+            overlap = seen.intersection(hashes)
+            if overlap:
+                raise ValueError(f"{len(overlap)} transactions appear in more than one shard")
+            seen.update(hashes)
+            merged.setdefault(name, []).extend(hashes)
+
+    merged = {name: sorted(hashes) for name, hashes in merged.items()}
+    json_codec.dump({'shard_index': 0, 'num_shards': 1, 'verdicts': merged}, output_file)
+
+    print("\n=== Merged Shards ===")
+    print(f"Total JSON files processed: {len(seen)}")
+    for name, hashes in merged.items():
+        print(f"  - {name}: {len(hashes)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Merge the outputs of hash-partitioned shard runs (see --num-shards/--shard-index).')
+    subparsers = parser.add_subparsers(dest='kind', required=True)
+
+    builds = subparsers.add_parser('builds', help='Merge parsing_tree_eventless.py output folders')
+    builds.add_argument('--shard-paths', nargs='+', required=True, help='Output folders of the shard runs')
+    builds.add_argument('--output-path', required=True, help='Merged output folder')
+
+    verdicts = subparsers.add_parser('verdicts', help='Merge detector harness --results-file outputs')
+    verdicts.add_argument('--inputs', nargs='+', required=True, help='Per-shard results files')
+    verdicts.add_argument('--output-file', required=True, help='Merged results file')
+
+    args = parser.parse_args()
+    if args.kind == 'builds':
+        merge_builds(args.shard_paths, args.output_path)
+    else:
+        merge_verdicts(args.inputs, args.output_file)
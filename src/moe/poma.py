@@ -1,62 +1,79 @@
 #!/usr/bin/env python3
-import json
+import os
+import sys
+import heapq
+import bisect
 import argparse
 
-# Global counter for preorder order
-order_counter = 1
+# The src folder holds the shared JSON codec; appended so it never shadows this folder's modules.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import json_codec
 
 
-def traverse_tree(node, depth, transfer_calls):
+def transfer_record(node, order, depth):
     """
-    Traverse the action tree in preorder and assign order and depth.
-    If the node represents a function call of type "transfer" or "transferFrom" and contains
-    the required keys, record it in the transfer_calls list with an added "call_type" field.
-    Then traverse its children under the "nodes" key.
+    The transfer record of a node visited at (order, depth) in preorder, or None.
+    A function call of type "transfer" or "transferFrom" that contains the required keys
+    is recorded with an added "call_type" field.
     """
-    global order_counter
-    current_order = order_counter
-    order_counter += 1
+    if node.get("type") != "function":
+        return None
+    # Check for a "transfer" call.
+    if node.get("action") == "transfer":
+        # Ensure keys exist and the "values" field is a list with at least 2 elements.
+        if "sender" in node and "receiver" in node and "values" in node:
+            vals = node["values"]
+            if isinstance(vals, list) and len(vals) >= 2:
+                return {
+                    "order": order,
+                    "depth": depth,
+                    "call_type": "transfer",
+                    "sender": node["sender"],
+                    "receiver": node["receiver"],
+                    "values": vals  # values[0] and values[1] will be used.
+                }
+    # Check for a "transferFrom" call.
+    elif node.get("action") == "transferFrom":
+        # Ensure keys exist, including a sender, receiver, and the "values" field as a list with at least 3 elements.
+        if "sender" in node and "receiver" in node and "values" in node:
+            vals = node["values"]
+            if isinstance(vals, list) and len(vals) >= 3:
+                return {
+                    "order": order,
+                    "depth": depth,
+                    "call_type": "transferFrom",
+                    "sender": node["sender"],
+                    "receiver": node["receiver"],
+                    # values[0], values[1], values[2] will be used.
+                    "values": vals
+                }
+    return None
 
-    # Annotate the node with order and depth attributes.
-    node["order"] = current_order
-    node["depth"] = depth
 
-    if node.get("type") == "function":
-        # Check for a "transfer" call.
-        if node.get("action") == "transfer":
-            # Ensure keys exist and the "values" field is a list with at least 2 elements.
-            if "sender" in node and "receiver" in node and "values" in node:
-                vals = node["values"]
-                if isinstance(vals, list) and len(vals) >= 2:
-                    transfer_info = {
-                        "order": current_order,
-                        "depth": depth,
-                        "call_type": "transfer",
-                        "sender": node["sender"],
-                        "receiver": node["receiver"],
-                        "values": vals  # values[0] and values[1] will be used.
-                    }
-                    transfer_calls.append(transfer_info)
-        # Check for a "transferFrom" call.
-        elif node.get("action") == "transferFrom":
-            # Ensure keys exist, including a sender, receiver, and the "values" field as a list with at least 3 elements.
-            if "sender" in node and "receiver" in node and "values" in node:
-                vals = node["values"]
-                if isinstance(vals, list) and len(vals) >= 3:
-                    transfer_info = {
-                        "order": current_order,
-                        "depth": depth,
-                        "call_type": "transferFrom",
-                        "sender": node["sender"],
-                        "receiver": node["receiver"],
-                        # values[0], values[1], values[2] will be used.
-                        "values": vals
-                    }
-                    transfer_calls.append(transfer_info)
+def traverse_tree(node, depth, transfer_calls, order=1):
+    """
+    Traverse the action tree in preorder and assign order and depth, node being visited at (order, depth).
+    If the node represents a function call of type "transfer" or "transferFrom" and contains
+    the required keys, record it in the transfer_calls list (see transfer_record).
+    Then traverse its children under the "nodes" key.
+    Returns the order of the node following this subtree, so no counter outlives a traversal; the tree is not modified.
+    """
+    transfer_info = transfer_record(node, order, depth)
+    if transfer_info is not None:
+        transfer_calls.append(transfer_info)
 
     # Traverse children nodes if present.
+    next_order = order + 1
     for child in node.get("nodes", []):
-        traverse_tree(child, depth + 1, transfer_calls)
+        next_order = traverse_tree(child, depth + 1, transfer_calls, next_order)
+    return next_order
+
+
+def collect_transfers(tree):
+    """The "transfer" and "transferFrom" call records of an action tree, in preorder (root: order 1, depth 1)."""
+    transfer_calls = []
+    traverse_tree(tree, depth=1, transfer_calls=transfer_calls)
+    return transfer_calls
 
 
 def form_transacts(transfer_calls):
@@ -97,82 +114,72 @@ def form_transacts(transfer_calls):
          amount_in = t1.values[2],
          amount_out = t2.values[1].
     Returns a list of transact dictionaries.
+
+    Instead of testing every pair, each case is evaluated as a hash join: "transfer" calls are
+    indexed by (values[0], sender) and "transferFrom" calls by (values[1], values[2]), so for
+    every t1 only the later calls whose key matches t1's are visited. Transacts are produced in
+    the same (t1, t2) order as a pairwise scan.
     """
+    transfer_index = {}
+    transfer_from_index = {}
+    for pos, call in enumerate(transfer_calls):
+        if call["call_type"] == "transfer":
+            key = (hashable(call["values"][0]), hashable(call["sender"]))
+            transfer_index.setdefault(key, []).append(pos)
+        elif call["call_type"] == "transferFrom":
+            key = (hashable(call["values"][1]), hashable(call["values"][2]))
+            transfer_from_index.setdefault(key, []).append(pos)
+
     transacts = []
-    n = len(transfer_calls)
-    for i in range(n):
-        t1 = transfer_calls[i]
-        for j in range(i + 1, n):
+    for i, t1 in enumerate(transfer_calls):
+        if t1["call_type"] == "transfer":
+            # Case 1: t1.sender == t2.values[0] and t2.sender == t1.values[0].
+            key = (hashable(t1["sender"]), hashable(t1["values"][0]))
+            matches = later_than(transfer_index.get(key, []), i)
+        elif t1["call_type"] == "transferFrom":
+            # Case 2 (t2 is transferFrom): t1.values[0] == t2.values[1] and t1.values[1] == t2.values[2].
+            # Case 3 (t2 is transfer): t1.values[0] == t2.values[0] and t1.values[1] == t2.sender.
+            key = (hashable(t1["values"][0]), hashable(t1["values"][1]))
+            matches = heapq.merge(later_than(transfer_from_index.get(key, []), i),
+                                  later_than(transfer_index.get(key, []), i))
+        else:
+            continue
+
+        for j in matches:
             t2 = transfer_calls[j]
-            # Case 1: Both calls are "transfer"
-            if t1["call_type"] == "transfer" and t2["call_type"] == "transfer":
-                if t1["receiver"] == t2["receiver"]:
-                    continue
-                if t1["sender"] != t2["values"][0]:
-                    continue
-                if t2["sender"] != t1["values"][0]:
-                    continue
-                transact = {
-                    "operator": t1["sender"],
-                    "pool": t2["sender"],
-                    "token_in": t1["receiver"],
-                    "token_out": t2["receiver"],
-                    "amount_in": t1["values"][1],
-                    "amount_out": t2["values"][1],
-                    "t1_order": t1["order"],
-                    "t2_order": t2["order"],
-                    "t1_depth": t1["depth"],
-                    "t2_depth": t2["depth"],
-                    "call_types": (t1["call_type"], t2["call_type"])
-                }
-                transacts.append(transact)
-            # Case 2: Both calls are "transferFrom"
-            elif t1["call_type"] == "transferFrom" and t2["call_type"] == "transferFrom":
-                if t1["receiver"] == t2["receiver"]:
-                    continue
-                if t1["values"][0] != t2["values"][1]:
-                    continue
-                if t1["values"][1] != t2["values"][2]:
-                    continue
-                transact = {
-                    "operator": t1["sender"],
-                    "pool": t2["sender"],
-                    "token_in": t1["receiver"],
-                    "token_out": t2["receiver"],
-                    "amount_in": t1["values"][2],
-                    "amount_out": t2["values"][2],
-                    "t1_order": t1["order"],
-                    "t2_order": t2["order"],
-                    "t1_depth": t1["depth"],
-                    "t2_depth": t2["depth"],
-                    "call_types": (t1["call_type"], t2["call_type"])
-                }
-                transacts.append(transact)
-            # Case 3: Combination of one "transferFrom" (t1) and one "transfer" (t2)
-            elif t1["call_type"] == "transferFrom" and t2["call_type"] == "transfer":
-                if t1["receiver"] == t2["receiver"]:
-                    continue
-                if t1["values"][0] != t2["values"][0]:
-                    continue
-                if t1["values"][1] != t2["sender"]:
-                    continue
-                transact = {
-                    "operator": t1["sender"],
-                    "pool": t2["sender"],
-                    "token_in": t1["receiver"],
-                    "token_out": t2["receiver"],
-                    "amount_in": t1["values"][2],
-                    "amount_out": t2["values"][1],
-                    "t1_order": t1["order"],
-                    "t2_order": t2["order"],
-                    "t1_depth": t1["depth"],
-                    "t2_depth": t2["depth"],
-                    "call_types": (t1["call_type"], t2["call_type"])
-                }
-                transacts.append(transact)
+            if t1["receiver"] == t2["receiver"]:
+                continue
+            amount_in = t1["values"][1] if t1["call_type"] == "transfer" else t1["values"][2]
+            amount_out = t2["values"][1] if t2["call_type"] == "transfer" else t2["values"][2]
+            transact = {
+                "operator": t1["sender"],
+                "pool": t2["sender"],
+                "token_in": t1["receiver"],
+                "token_out": t2["receiver"],
+                "amount_in": amount_in,
+                "amount_out": amount_out,
+                "t1_order": t1["order"],
+                "t2_order": t2["order"],
+                "t1_depth": t1["depth"],
+                "t2_depth": t2["depth"],
+                "call_types": (t1["call_type"], t2["call_type"])
+            }
+            transacts.append(transact)
     return transacts
 
 
+def hashable(value):
+    """Turn decoded values (which may be nested lists) into an equivalent hashable key."""
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    return value
+
+
+def later_than(positions, i):
+    """Positions from an ascending position list that come after i."""
+    return positions[bisect.bisect_right(positions, i):]
+
+
 def detect_price_manipulation(transacts):
     """
     Detect a "price manipulation" pattern in an action tree based on transacts.
@@ -182,28 +189,32 @@ def detect_price_manipulation(transacts):
          - a.token_in == c.token_out.
          - a.token_out == c.token_in == b.token_out.
     Returns a tuple (detected: bool, (a, b, c) if detected else None).
+
+    Transacts are indexed by (pool, token_out) for b and by (pool, token_in, token_out) for c,
+    so each a needs two dictionary lookups; only the first few entries of c's list are ever
+    inspected (to skip a and b themselves). The reported triple is the one a nested loop over
+    (a, b, c) finds first.
     """
-    n = len(transacts)
-    for i in range(n):
-        a = transacts[i]
-        for j in range(n):
-            if i == j:
+    by_pool_out = {}
+    by_pool_in_out = {}
+    for pos, tx in enumerate(transacts):
+        pool, token_in, token_out = hashable(tx["pool"]), hashable(tx["token_in"]), hashable(tx["token_out"])
+        by_pool_out.setdefault((pool, token_out), []).append(pos)
+        by_pool_in_out.setdefault((pool, token_in, token_out), []).append(pos)
+
+    for i, a in enumerate(transacts):
+        pool, token_in, token_out = hashable(a["pool"]), hashable(a["token_in"]), hashable(a["token_out"])
+        # c swaps back what a swapped: c.token_in == a.token_out and c.token_out == a.token_in.
+        c_positions = by_pool_in_out.get((pool, token_out, token_in))
+        if not c_positions:
+            continue
+        # b ends in the same token as a: b.token_out == a.token_out.
+        for j in by_pool_out[(pool, token_out)]:
+            if j == i:
                 continue
-            b = transacts[j]
-            for k in range(n):
-                if k == i or k == j:
-                    continue
-                c = transacts[k]
-                # Condition 1: All three transacts have the same pool.
-                if not (a["pool"] == b["pool"] == c["pool"]):
-                    continue
-                # Condition 2: token_in of 'a' equals token_out of 'c'
-                if a["token_in"] != c["token_out"]:
-                    continue
-                # Condition 3: token_out of 'a' equals token_in of 'c' and equals token_out of 'b'
-                if a["token_out"] != c["token_in"] or a["token_out"] != b["token_out"]:
-                    continue
-                return True, (a, b, c)
+            k = next((k for k in c_positions if k != i and k != j), None)
+            if k is not None:
+                return True, (a, transacts[j], transacts[k])
     return False, None
 
 
@@ -253,16 +264,10 @@ def main():
     args = parser.parse_args()
 
     # Load the JSON tree from file.
-    with open(args.input_file, "r") as f:
-        tree = json.load(f)
-
-    # Reset the global order counter.
-    global order_counter
-    order_counter = 1
+    tree = json_codec.load(args.input_file)
 
     # Traverse the tree to gather all "transfer" and "transferFrom" function call nodes.
-    transfer_calls = []
-    traverse_tree(tree, depth=1, transfer_calls=transfer_calls)
+    transfer_calls = collect_transfers(tree)
 
     # Form valid transacts from the collected calls.
     transacts = form_transacts(transfer_calls)
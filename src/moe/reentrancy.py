@@ -1,41 +1,57 @@
 #!/usr/bin/env python3
-import json
+import os
+import sys
+import bisect
 import argparse
 
-# Global counter for preorder order
-order_counter = 1
+# The src folder holds the shared JSON codec; appended so it never shadows this folder's modules.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import json_codec
 
 
-def traverse_tree(node, depth, calls):
+def call_record(node, order, depth):
     """
-    Traverse the action tree in preorder and assign order and depth.
-    If the node represents a function call (i.e., its "type" is "function" and it contains sender, receiver, and action keys),
-    record it as a dictionary with its order, depth, and call details.
-    Then traverse its children under the "nodes" key.
+    The call record of a node visited at (order, depth) in preorder: its order, depth and call
+    details if it is a function call (type "function" with sender, receiver, and action keys),
+    otherwise None.
     """
-    global order_counter
-    current_order = order_counter
-    order_counter += 1
-
-    # Annotate the node with order and depth attributes
-    node["order"] = current_order
-    node["depth"] = depth
-
-    # If the node is a function call, record its details.
     # Updated: using "action" as the function name.
     if node.get("type") == "function" and "sender" in node and "receiver" in node and "action" in node:
-        call_info = {
-            "order": current_order,
+        return {
+            "order": order,
             "depth": depth,
             "sender": node["sender"],
             "receiver": node["receiver"],
             "function": node["action"]  # using "action" key as function name
         }
+    return None
+
+
+def traverse_tree(node, depth, calls, order=1):
+    """
+    Traverse the action tree in preorder and assign order and depth, node being visited at (order, depth).
+    If the node represents a function call (i.e., its "type" is "function" and it contains sender, receiver, and action keys),
+    record it as a dictionary with its order, depth, and call details.
+    Then traverse its children under the "nodes" key.
+    Returns the order of the node following this subtree, so no counter outlives a traversal; the tree is not modified.
+    """
+    # If the node is a function call, record its details.
+    call_info = call_record(node, order, depth)
+    if call_info is not None:
         calls.append(call_info)
 
     # Traverse children if they exist.
+    next_order = order + 1
     for child in node.get("nodes", []):
-        traverse_tree(child, depth + 1, calls)
+        next_order = traverse_tree(child, depth + 1, calls, next_order)
+    return next_order
+
+
+def collect_calls(tree):
+    """The call records of an action tree, in preorder (root: order 1, depth 1)."""
+    calls = []
+    traverse_tree(tree, depth=1, calls=calls)
+    return calls
 
 
 def is_inverse(call_a, call_b):
@@ -58,6 +74,30 @@ def is_same_call(call_a, call_b):
             call_a["receiver"] == call_b["receiver"])
 
 
+def index_by_depth(calls, key):
+    """
+    Group calls by key(call) and, inside each group, by depth.
+    Each (group, depth) entry holds the calls' orders in ascending order and
+    the matching positions in calls, ready for binary search.
+    """
+    index = {}
+    for pos, call in sorted(enumerate(calls), key=lambda item: item[1]["order"]):
+        by_depth = index.setdefault(key(call), {})
+        orders, positions = by_depth.setdefault(call["depth"], ([], []))
+        orders.append(call["order"])
+        positions.append(pos)
+    return index
+
+
+def first_after(entry, order):
+    """Return (order, position) of the first call in a depth entry with a larger order, or None."""
+    orders, positions = entry
+    idx = bisect.bisect_right(orders, order)
+    if idx == len(orders):
+        return None
+    return orders[idx], positions[idx]
+
+
 def detect_reentrancy(calls):
     """
     Detect the reentrancy pattern based on the following updated conditions:
@@ -66,36 +106,62 @@ def detect_reentrancy(calls):
       - Their depths satisfy: depth_A > depth_C > depth_B,
       - Their orders in the preorder traversal satisfy: order_A < order_B < order_C.
     If such a triple exists, the action tree exhibits reentrancy.
+
+    Calls are indexed by (sender, receiver, function) for B and by (sender, receiver) for C,
+    each split by depth into sorted order lists. For a given A and depth of B, the earliest B
+    after A dominates later ones (it leaves the widest window for C), and a C exists iff some
+    depth strictly between B and A has an inverse call after B. Walking the depths below A
+    downwards while keeping the latest inverse call seen so far answers that with one binary
+    search per depth, so each A costs a single pass over the depths instead of a scan over all
+    (B, C) pairs. For calls in traversal order the returned triple is the same one a nested
+    loop over (A, B, C) finds first.
     """
-    n = len(calls)
-    for i in range(n):
-        call_A = calls[i]
-        for j in range(n):
-            if i == j:
-                continue
-            call_B = calls[j]
-            # Check same function call and that call_A is deeper than call_B and comes earlier in order.
-            if not is_same_call(call_A, call_B):
-                continue
-            if not (call_A["depth"] > call_B["depth"] and call_A["order"] < call_B["order"]):
+    same_calls = index_by_depth(calls, lambda call: (call["sender"], call["receiver"], call["function"]))
+    directed_calls = index_by_depth(calls, lambda call: (call["sender"], call["receiver"]))
+    # Depths holding a B or C candidate for A's (sender, receiver, function), deepest first.
+    depths_by_key = {}
+
+    for call_A in calls:
+        inverse = directed_calls.get((call_A["receiver"], call_A["sender"]))
+        if not inverse:
+            continue
+        key = (call_A["sender"], call_A["receiver"], call_A["function"])
+        same = same_calls[key]
+        depths = depths_by_key.get(key)
+        if depths is None:
+            depths = depths_by_key[key] = sorted(same.keys() | inverse.keys(), reverse=True)
+
+        best_b = None
+        # Largest order of an inverse call at the depths visited so far, i.e. strictly
+        # between the current depth and A's.
+        latest_inverse = 0
+        for depth in depths:
+            if depth >= call_A["depth"]:
                 continue
-            # Now look for call_C that is an inverse call of call_A and satisfies the updated depth and order conditions.
-            for k in range(n):
-                if k == i or k == j:
-                    continue
-                call_C = calls[k]
-                if not is_inverse(call_A, call_C):
-                    continue
-                if (call_A["depth"] > call_C["depth"] > call_B["depth"] and
-                        call_A["order"] < call_B["order"] < call_C["order"]):
-                    return True, (call_A, call_B, call_C)
+            entry = same.get(depth)
+            if entry is not None:
+                b = first_after(entry, call_A["order"])
+                if b is not None and latest_inverse > b[0] and (best_b is None or b[0] < best_b[0][0]):
+                    best_b = (b, depth)
+            inverse_entry = inverse.get(depth)
+            if inverse_entry is not None:
+                latest_inverse = max(latest_inverse, inverse_entry[0][-1])
+
+        if best_b is None:
+            continue
+        (order_b, pos_b), depth_b = best_b
+        candidates_c = [first_after(inverse_entry, order_b)
+                        for depth_c, inverse_entry in inverse.items()
+                        if depth_b < depth_c < call_A["depth"]]
+        _, pos_c = min(c for c in candidates_c if c is not None)
+        return True, (call_A, calls[pos_b], calls[pos_c])
     return False, None
 
 
 def main():
     parser = argparse.ArgumentParser(
         description=("Detect if an action tree JSON exhibits reentrancy.\n\n"
-                     "Each node in the JSON tree is annotated with:\n"
+                     "Each node in the JSON tree is assigned:\n"
                      "  - order: the order from a preorder traversal.\n"
                      "  - depth: the level of the node in the tree (root is depth 1).\n\n"
                      "A function call node is defined as having type 'function' and containing the keys: sender, receiver, and action.\n"
@@ -109,16 +175,10 @@ def main():
     args = parser.parse_args()
 
     # Load the JSON tree.
-    with open(args.input_file, "r") as f:
-        tree = json.load(f)
-
-    # Reset the global order counter.
-    global order_counter
-    order_counter = 1
+    tree = json_codec.load(args.input_file)
 
     # Traverse the tree and record all function call nodes.
-    calls = []
-    traverse_tree(tree, depth=1, calls=calls)
+    calls = collect_calls(tree)
 
     # Detect the reentrancy pattern.
     detected, triple = detect_reentrancy(calls)
@@ -141,6 +141,42 @@ def parse_parameters_via_split(parameter_string):
     return stack[0], ignored
 
 
+def decode_signature(signature, inputs):
+    """
+    Split a decoded function signature into its action name and parameter
+    structure, and convert the raw input words into typed values.
+
+    Returns (name, parameters, values, ignored, matched), where matched is
+    False when the signature is an '(unknown)' placeholder.
+    """
+    name, parameters = split_signature(signature)
+    ignored = False
+    matched = True
+
+    if parameters == '(unknown)':
+        matched = False
+        parameters = None
+
+    if name in ('ether_transfer', 'create_contract', 'suicide_contract'):
+        ignored = True
+
+    # process the parameters  input for functions here maybe
+    processed_para = [None]
+
+    if parameters != '()' and parameters != None:
+        processed_para, ignored = parse_parameters_via_split(parameters)
+
+        if ignored != True:
+            converted_values = convert_input_to_values_arrays(
+                processed_para, inputs)
+        else:
+            converted_values = []
+    else:
+        converted_values = []
+
+    return name, processed_para, converted_values, ignored, matched
+
+
 def add_elements_in_range(
         from_structure,
         to_structure,
@@ -170,39 +206,20 @@ def add_elements_in_range(
 
         row = from_structure[i]
         # print(row)
-        name, parameters = split_signature(row['name'])
-        ignored = False
+        name, processed_para, converted_values, ignored, matched = decode_signature(
+            row['name'], row['inputs'])
 
-        if parameters == '(unknown)':
+        if not matched:
             name_match -= 1
-            parameters = None
 
         if name == 'ether_transfer':
             found_ether = True
-            ignored = True
 
         elif name == 'create_contract':
             found_create = True
-            ignored = True
 
         elif name == 'suicide_contract':
             found_suicide = True
-            ignored = True
-
-        # process the parameters  input for functions here maybe
-        processed_para = [None]
-
-        if parameters != '(unknown)' and parameters != '()' and parameters != None:
-            processed_para, ignored = parse_parameters_via_split(parameters)
-
-            if ignored != True:
-                # print(processed_para)
-                converted_values = convert_input_to_values_arrays(
-                    processed_para, row['inputs'])
-            else:
-                converted_values = []
-        else:
-            converted_values = []
 
         if ignored:
             total_ignored = total_ignored + 1
@@ -347,7 +364,14 @@ def merge_events_functions(
         current_matched,
         processed_data,
         current_igored,
-        output_path):
+        output_path,
+        counts=None):
+    """
+    Merge decoded events into the call list. Whether the transaction
+    transfers ether, creates or self-destructs a contract is added to the
+    shared *_count.json counters under output_path, or stored in the counts
+    dict ('ether', 'create', 'suicide') instead when one is given.
+    """
 
     merged_tree = []
     unfound_addr = set()
@@ -441,6 +465,10 @@ def merge_events_functions(
     have_ether = have_ether or check_ether
     have_suicide = have_suicide or check_suicide
 
+    if counts is not None:
+        counts.update(ether=int(have_ether), create=int(have_create), suicide=int(have_suicide))
+        return merged_tree, unmatched, total_nodes, name_match, total_ignored
+
     if have_create == True:
         update_count(create_count_path, 1)
 
@@ -1,8 +1,8 @@
 import subprocess
-import json
-import concurrent.futures
+import json_codec
 import argparse
 from hex_decoder import read_json, write_json
+from scheduler import run_bounded, largest_first, file_size_or_zero
 import os
 from filelock import FileLock
 
@@ -12,7 +12,10 @@ def main(
         event_path,
         hash_path,
         output_path,
-        event_input_path):
+        event_input_path,
+        max_workers=None,
+        max_in_flight=None,
+        order='listing'):
 
     os.makedirs(output_path, exist_ok=True)
 
@@ -38,24 +41,26 @@ def main(
     reset_count_in_json(suicide_count_path)
 
     hash_list = read_hashes_from_json(input_path)
+    if order == 'largest-first':
+        hash_list = largest_first(
+            hash_list, lambda hash: file_size_or_zero(f'{trace_path}/{hash}.json'))
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(run_script, script_path, hash, trace_path,
-                                   event_path, output_path, event_input_path) for hash in hash_list]
+    def build(hash):
+        run_script(script_path, hash, trace_path,
+                   event_path, output_path, event_input_path)
 
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(
-                    f"Script execution for hash {hash} failed with exception: {e}")
-                # write_failed_hash(failed_hashes_path, failed_hashes_lock_path, hash)
+    for hash, _, error in run_bounded(build, hash_list, max_workers=max_workers,
+                                      max_in_flight=max_in_flight, total=len(hash_list),
+                                      desc="Building action trees"):
+        if error is not None:
+            print(
+                f"Script execution for hash {hash} failed with exception: {error}")
+            # write_failed_hash(failed_hashes_path, failed_hashes_lock_path, hash)
 
 
 def read_hashes_from_json(file_path):
 
-    with open(file_path, 'r') as file:
-        data = json.load(file)
+    data = json_codec.load(file_path)
 
     hash_list = [item['transaction_hash'] for item in data]
 
@@ -83,13 +88,11 @@ def write_failed_hash(file_path,
         if not os.path.exists(file_path):
             failed_hashes = []
         else:
-            with open(file_path, 'r') as file:
-                failed_hashes = json.load(file)
+            failed_hashes = json_codec.load(file_path)
 
         failed_hashes.append(hash)
 
-        with open(file_path, 'w') as file:
-            json.dump(failed_hashes, file, indent=4)
+        json_codec.dump(failed_hashes, file_path)
 
 
 if __name__ == "__main__":
@@ -106,7 +109,14 @@ if __name__ == "__main__":
                         help='Path to the output')
     parser.add_argument('--event-input-path', required=True,
                         help='Path to the event inputs')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='Number of concurrent builder processes')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='Maximum number of submitted-but-unfinished transactions')
+    parser.add_argument('--order', choices=['listing', 'largest-first'], default='listing',
+                        help='Schedule transactions in hash file order or largest trace first')
 
     args = parser.parse_args()
     main(args.trace_path, args.event_path, args.hash_path,
-         args.output_path, args.event_input_path)
+         args.output_path, args.event_input_path,
+         args.max_workers, args.max_in_flight, args.order)
@@ -1,48 +1,94 @@
 #!/usr/bin/env python3
 import os
-import json
+import json_codec
 import shutil
+import hashlib
 import subprocess
 import argparse
-import concurrent.futures
 from filelock import FileLock
 from tqdm import tqdm
 from hex_decoder import read_json, write_json
+from scheduler import run_bounded, largest_first, file_size_or_zero
+from sharding import in_shard, add_shard_arguments, check_shard_arguments
+from selector_decoder import SELECTOR_DATABASE_PATH
 
-def main(trace_path, event_path, output_path, event_input_path, trace_mode):
+MANIFEST_FILE = 'manifest.jsonl'
+# Which hash partition an output folder holds, checked by merge_shards.py.
+SHARD_FILE = 'shard.json'
+# Totals derived from the per-transaction flags recorded in the manifest.
+COUNT_FILES = {'ether': 'ether_count.json', 'create': 'create_count.json', 'suicide': 'suicide_count.json'}
+# Sources whose content determines the action tree a transaction produces.
+BUILDER_SOURCES = ['actiontree_local_eventless.py', 'parser.py', 'selector_decoder.py', 'utils.py']
+
+def main(trace_path, event_path, output_path, event_input_path, trace_mode, resume=True,
+         max_workers=None, max_in_flight=None, order='listing', num_shards=1, shard_index=0):
     # Prepare output directories
     prepare_directories(output_path)
-    initialize_counts(output_path)
+
+    manifest_path = os.path.join(output_path, MANIFEST_FILE)
+    if not resume and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    record_shard(output_path, shard_index, num_shards, resume)
 
     script_path = os.path.join('.', 'src', 'actiontree_local_eventless.py')
+    manifest = {
+        'path': manifest_path,
+        'builder_version': compute_builder_version(os.path.dirname(script_path), SELECTOR_DATABASE_PATH),
+        'records': load_manifest(manifest_path),
+    }
+    outdated = sum(record['builder_version'] != manifest['builder_version'] for record in manifest['records'].values())
+    if outdated:
+        print(f"{outdated} transactions were built by other builder sources or another selector database "
+              f"and will be rebuilt.")
+    scheduling = {'max_workers': max_workers, 'max_in_flight': max_in_flight, 'order': order}
+    shard = (shard_index, num_shards)
 
     if trace_mode == "default":
-        process_default_mode(trace_path, script_path, event_path, output_path, event_input_path)
+        process_default_mode(trace_path, script_path, event_path, output_path, event_input_path, manifest, scheduling, shard)
     elif trace_mode == "jsonl":
-        process_jsonl_mode(trace_path, script_path, event_path, output_path, event_input_path)
+        process_jsonl_mode(trace_path, script_path, event_path, output_path, event_input_path, manifest, scheduling, shard)
+
+    write_counts(output_path, manifest['records'])
 
 def prepare_directories(output_path):
     """Create necessary directories under output_path."""
-    for subdir in ['actiontree', 'orphaned', 'stats']:
+    for subdir in ['actiontree', 'orphaned', 'stats', 'unresolved']:
         os.makedirs(os.path.join(output_path, subdir), exist_ok=True)
 
-def initialize_counts(output_path):
-    """Reset counts in specific JSON files."""
-    count_files = ['ether_count.json', 'create_count.json', 'suicide_count.json']
-    for fname in count_files:
-        file_path = os.path.join(output_path, fname)
-        reset_count_in_json(file_path)
+def record_shard(output_path, shard_index, num_shards, resume=True):
+    """
+    Save the shard this output folder holds. Resuming a folder built for
+    another shard would mix two partitions, so it is refused.
+    """
+    shard_path = os.path.join(output_path, SHARD_FILE)
+    shard = {'shard_index': shard_index, 'num_shards': num_shards}
+    previous = read_json(shard_path)
+    if resume and previous and previous != shard:
+        raise ValueError(f"{output_path} holds shard {previous['shard_index']} of {previous['num_shards']}, "
+                         f"not {shard_index} of {num_shards}; use another folder or --no-resume")
+    write_json(shard_path, shard)
+
+def write_counts(output_path, records):
+    """
+    Rewrite the ether/create/suicide count files from the latest manifest record
+    of every transaction. Only transactions whose last build is done are counted,
+    each once, however many times it was rebuilt or retried.
+    """
+    for key, fname in COUNT_FILES.items():
+        total = sum(record.get('counts', {}).get(key, 0)
+                    for record in records.values() if record['status'] == 'done')
+        write_json(os.path.join(output_path, fname), {'count': total})
 
-def process_default_mode(trace_path, script_path, event_path, output_path, event_input_path):
+def process_default_mode(trace_path, script_path, event_path, output_path, event_input_path, manifest, scheduling, shard):
     """Process trace files in default mode (each .json file treated individually)."""
-    hash_list = read_hashes_from_trace_dir(trace_path)
-    run_batch(script_path, hash_list, trace_path, event_path, output_path, event_input_path)
+    hash_list = (hash_val for hash_val in read_hashes_from_trace_dir(trace_path) if in_shard(hash_val, *shard))
+    run_batch(script_path, hash_list, trace_path, event_path, output_path, event_input_path, manifest, **scheduling)
 
-def process_jsonl_mode(trace_path, script_path, event_path, output_path, event_input_path):
+def process_jsonl_mode(trace_path, script_path, event_path, output_path, event_input_path, manifest, scheduling, shard):
     """
     Process trace files in JSONL mode.
-    For each large JSONL file in trace_path, convert its lines into proper JSON files,
-    run the processing batch, then clean up the temporary files.
+    For each large JSONL file in trace_path, convert the lines belonging to this shard into
+    proper JSON files, run the processing batch, then clean up the temporary files.
     """
     temp_trace_path = os.path.join(output_path, "trace_temp")
     os.makedirs(temp_trace_path, exist_ok=True)
@@ -51,35 +97,71 @@ def process_jsonl_mode(trace_path, script_path, event_path, output_path, event_i
     jsonl_files = [f for f in os.listdir(trace_path) if not f.endswith('.json')]
     for jsonl_filename in tqdm(jsonl_files, desc="Processing jsonl files", unit="file"):
         src_file = os.path.join(trace_path, jsonl_filename)
-        process_single_jsonl_file(src_file, temp_trace_path)
+        process_single_jsonl_file(src_file, temp_trace_path, shard)
         hash_list = read_hashes_from_trace_dir(temp_trace_path)
-        run_batch(script_path, hash_list, temp_trace_path, event_path, output_path, event_input_path)
+        run_batch(script_path, hash_list, temp_trace_path, event_path, output_path, event_input_path, manifest, **scheduling)
         clean_temp_folder(temp_trace_path)
 
-def run_batch(script_path, hash_list, trace_path, event_path, output_path, event_input_path):
+def run_batch(script_path, hash_list, trace_path, event_path, output_path, event_input_path, manifest,
+              max_workers=None, max_in_flight=None, order='listing'):
     """
     Execute the given script concurrently on a batch of hash values (transactions).
+    Hashes are consumed lazily with at most max_in_flight builds pending at once.
+    With order='largest-first' the batch is materialised and sorted by trace file size
+    so the most expensive transactions are scheduled first.
+    Transactions already built from the same input by the same builder version are skipped;
+    every attempt is recorded in the manifest.
     """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(run_script, script_path, hash_val, trace_path, event_path, output_path, event_input_path)
-            for hash_val in hash_list
-        ]
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"Script execution failed with exception: {e}")
-                # Optionally log the failed hash using write_failed_hash function.
+    skipped = 0
+    if order == 'largest-first':
+        hash_list = largest_first(
+            hash_list, lambda hash_val: file_size_or_zero(os.path.join(trace_path, f'{hash_val}.json')))
+
+    def pending_jobs():
+        nonlocal skipped
+        for hash_val in hash_list:
+            input_hash = compute_file_digest(os.path.join(trace_path, f'{hash_val}.json'))
+            if is_up_to_date(manifest['records'].get(hash_val), input_hash, manifest['builder_version']):
+                skipped += 1
+                continue
+            yield hash_val, input_hash
+
+    def build(job):
+        run_script(script_path, job[0], trace_path, event_path, output_path, event_input_path)
+
+    for (hash_val, input_hash), _, error in run_bounded(
+            build, pending_jobs(), max_workers=max_workers, max_in_flight=max_in_flight,
+            desc="Building action trees"):
+        if error is None:
+            status = 'done'
+        else:
+            print(f"Script execution for hash {hash_val} failed with exception: {error}")
+            status = 'failed'
+        record = {
+            'tx_hash': hash_val,
+            'input_hash': input_hash,
+            'builder_version': manifest['builder_version'],
+            'status': status,
+        }
+        if status == 'done':
+            record['counts'] = read_build_counts(output_path, hash_val)
+        append_manifest_record(manifest['path'], record)
+        manifest['records'][hash_val] = record
+
+    if skipped:
+        print(f"Skipped {skipped} transactions already built.")
 
 def read_hashes_from_trace_dir(trace_dir):
     """
-    Return a list of transaction hashes extracted from filenames ending with '.json'
+    Lazily yield transaction hashes extracted from filenames ending with '.json'
     in the given directory.
     """
-    return [os.path.splitext(filename)[0] for filename in os.listdir(trace_dir) if filename.endswith('.json')]
+    with os.scandir(trace_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.json'):
+                yield os.path.splitext(entry.name)[0]
 
-def process_single_jsonl_file(src_file, temp_trace_path):
+def process_single_jsonl_file(src_file, temp_trace_path, shard=(0, 1)):
     """
     Process a single JSONL file:
       - For each line, parse the JSON.
@@ -87,7 +169,8 @@ def process_single_jsonl_file(src_file, temp_trace_path):
           { "transaction_hash": ..., "traces": [ { "from_address": ..., ... }, ... ] }
         to the proper format where every trace gets the transaction_hash field:
           [ { "transaction_hash": ..., "from_address": ..., ... }, ... ]
-      - Save the result as {transaction_hash}.json in temp_trace_path.
+      - Save the result as {transaction_hash}.json in temp_trace_path, skipping
+        transactions that belong to another shard.
     A progress bar shows progress across the lines.
     """
     # Count total lines for progress bar if possible.
@@ -99,22 +182,21 @@ def process_single_jsonl_file(src_file, temp_trace_path):
                 pbar.update(1)
                 continue
             try:
-                record = json.loads(line)
-            except json.JSONDecodeError:
+                record = json_codec.loads(line)
+            except json_codec.DecodeError:
                 pbar.update(1)
                 continue  # skip invalid JSON
 
             transaction_hash = record.get("transaction_hash")
             traces = record.get("traces", [])
-            if transaction_hash and traces and isinstance(traces, list):
+            if transaction_hash and traces and isinstance(traces, list) and in_shard(transaction_hash, *shard):
                 modified_traces = []
                 for trace in traces:
                     new_trace = trace.copy()
                     new_trace["transaction_hash"] = transaction_hash
                     modified_traces.append(new_trace)
                 out_file = os.path.join(temp_trace_path, f"{transaction_hash}.json")
-                with open(out_file, 'w') as outfile:
-                    json.dump(modified_traces, outfile, indent=4)
+                json_codec.dump(modified_traces, out_file)
             pbar.update(1)
 
 def clean_temp_folder(folder):
@@ -123,14 +205,10 @@ def clean_temp_folder(folder):
         if filename.endswith('.json'):
             os.remove(os.path.join(folder, filename))
 
-def reset_count_in_json(file_path):
-    """
-    Reset the 'count' field in the given JSON file to 0.
-    Assumes the file exists and has a 'count' key.
-    """
-    data = read_json(file_path)
-    data['count'] = 0
-    write_json(file_path, data)
+def read_build_counts(output_path, hash_val):
+    """The ether/create/suicide flags the builder stored in the transaction's stats file."""
+    stat_path = os.path.join(output_path, 'stats', f'{hash_val}_stat.json')
+    return read_json(stat_path).get('counts', {})
 
 def run_script(script_path, hash_val, trace_path, event_path, output_path, event_input_path):
     """
@@ -148,18 +226,66 @@ def run_script(script_path, hash_val, trace_path, event_path, output_path, event
         cmd.extend(['--event-input-path', event_input_path])
     subprocess.run(cmd, check=True)
 
-def write_failed_hash(file_path, lock_path, hash_val):
-    """Append a failed hash to the file in a thread-safe manner."""
-    lock = FileLock(lock_path)
+def compute_file_digest(file_path):
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def compute_builder_version(src_dir, selector_database_path=None):
+    """
+    Fingerprint the builder by hashing the sources that shape its output and the
+    selector database the trees are decoded with, so that refreshing the database
+    invalidates the trees decoded with the old one.
+    """
+    digest = hashlib.sha256()
+    for fname in BUILDER_SOURCES:
+        with open(os.path.join(src_dir, fname), 'rb') as file:
+            digest.update(file.read())
+    if selector_database_path and os.path.exists(selector_database_path):
+        digest.update(compute_file_digest(selector_database_path).encode())
+    return digest.hexdigest()[:16]
+
+def load_manifest(manifest_path):
+    """
+    Read the append-only manifest and return the latest record per transaction hash.
+    A truncated last line (from a crash mid-write) is ignored.
+    """
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path, 'r') as file:
+        for line in file:
+            try:
+                record = json_codec.loads(line)
+            except json_codec.DecodeError:
+                continue
+            records[record['tx_hash']] = record
+    return records
+
+def is_up_to_date(record, input_hash, builder_version):
+    """A transaction is skipped only if it completed from the same input with the same builder."""
+    return (record is not None and record['status'] == 'done'
+            and record['input_hash'] == input_hash
+            and record['builder_version'] == builder_version)
+
+def append_manifest_record(manifest_path, record):
+    """
+    Append one record to the manifest in a thread/process-safe manner.
+    A truncated last line left by a crash is terminated first, so that
+    only that line is lost and not the record appended after it.
+    """
+    line = json_codec.dumps(record, indent=None).encode() + b'\n'
+    lock = FileLock(manifest_path + '.lock')
     with lock:
-        if not os.path.exists(file_path):
-            failed_hashes = []
-        else:
-            with open(file_path, 'r') as file:
-                failed_hashes = json.load(file)
-        failed_hashes.append(hash_val)
-        with open(file_path, 'w') as file:
-            json.dump(failed_hashes, file, indent=4)
+        with open(manifest_path, 'ab+') as file:
+            if file.seek(0, os.SEEK_END) > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    line = b'\n' + line
+            file.write(line)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -176,5 +302,18 @@ if __name__ == "__main__":
                         help='Path to the event input files (optional)')
     parser.add_argument('--trace-mode', choices=['default', 'jsonl'], default='default',
                         help="Trace file mode: 'default' for individual .json files, 'jsonl' for large JSON Lines files.")
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Ignore the completion manifest and rebuild every transaction from scratch.')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='Number of concurrent builder processes (default: ThreadPoolExecutor default).')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='Maximum number of submitted-but-unfinished transactions (default: 4x workers).')
+    parser.add_argument('--order', choices=['listing', 'largest-first'], default='listing',
+                        help="Scheduling order: 'listing' streams hashes in directory order, "
+                             "'largest-first' sorts each batch by trace size to cut tail latency on skewed datasets.")
+    add_shard_arguments(parser)
     args = parser.parse_args()
-    main(args.trace_path, args.event_path, args.output_path, args.event_input_path, args.trace_mode)
\ No newline at end of file
+    check_shard_arguments(parser, args)
+    main(args.trace_path, args.event_path, args.output_path, args.event_input_path, args.trace_mode,
+         resume=not args.no_resume, max_workers=args.max_workers, max_in_flight=args.max_in_flight,
+         order=args.order, num_shards=args.num_shards, shard_index=args.shard_index)
\ No newline at end of file
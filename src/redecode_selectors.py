@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import json_codec
+import argparse
+from tqdm import tqdm
+from hex_decoder import read_json, write_json
+from parser import decode_signature
+from selector_decoder import load_selector_mapping, SELECTOR_DATABASE_PATH
+from utils import split_signature
+
+
+def main(output_path, cache_path):
+    """
+    Patch previously built action trees after the selector database has been updated.
+
+    The builder records, per transaction, the selectors it could not decode
+    under {output_path}/unresolved. Only trees listing a selector that is now
+    present in the database are loaded, and only the nodes still carrying that
+    raw selector as their action are re-decoded in place.
+    """
+    selector_mapping = load_selector_mapping(cache_path)
+    unresolved_dir = os.path.join(output_path, 'unresolved')
+
+    suffix = '_unresolved.json'
+    unresolved_files = [f for f in os.listdir(unresolved_dir) if f.endswith(suffix)]
+
+    patched_trees = 0
+    patched_nodes = 0
+    for filename in tqdm(unresolved_files, desc="Re-decoding selectors", unit="file"):
+        transaction_hash = filename[:-len(suffix)]
+        unresolved_path = os.path.join(unresolved_dir, filename)
+        unresolved = json_codec.load(unresolved_path)
+
+        resolvable = {sel for sel in unresolved if sel in selector_mapping}
+        if not resolvable:
+            continue
+
+        tree_path = os.path.join(output_path, 'actiontree', f'{transaction_hash}.json')
+        if not os.path.exists(tree_path):
+            continue
+
+        tree = json_codec.load(tree_path)
+
+        node_count, ignored_delta, matched_delta = redecode_tree(tree, resolvable, selector_mapping)
+
+        json_codec.dump(tree, tree_path)
+
+        if ignored_delta or matched_delta:
+            update_stats(output_path, transaction_hash, ignored_delta, matched_delta)
+
+        json_codec.dump([sel for sel in unresolved if sel not in resolvable], unresolved_path)
+
+        patched_trees += 1
+        patched_nodes += node_count
+
+    print(f"Patched {patched_nodes} nodes in {patched_trees} of {len(unresolved_files)} trees.")
+
+
+def redecode_tree(node, resolvable, selector_mapping):
+    """
+    Re-decode every function node whose action is still one of the raw
+    selectors in resolvable. Returns (patched node count, change in ignored
+    count, change in name match count).
+    """
+    node_count = 0
+    ignored_delta = 0
+    matched_delta = 0
+
+    sel = node.get('hex')
+    if node.get('type') == 'function' and sel in resolvable \
+            and node.get('action') == split_signature(sel)[0]:
+        name, processed_para, converted_values, ignored, matched = decode_signature(
+            selector_mapping[sel], node.get('values_raw', []))
+        ignored_delta += int(ignored) - int(bool(node.get('ignored')))
+        # The builder decoded the raw selector itself; count its match as decode_signature did.
+        matched_delta += int(matched) - int(split_signature(sel)[1] != '(unknown)')
+        node['action'] = name
+        node['ignored'] = ignored
+        node['parameters'] = processed_para
+        node['values'] = converted_values
+        node_count += 1
+
+    for child in node.get('nodes', []):
+        child_count, child_ignored, child_matched = redecode_tree(child, resolvable, selector_mapping)
+        node_count += child_count
+        ignored_delta += child_ignored
+        matched_delta += child_matched
+
+    return node_count, ignored_delta, matched_delta
+
+
+def update_stats(output_path, transaction_hash, ignored_delta, matched_delta):
+    """
+    Keep the per-transaction selector statistics (matches, missing, ignored and
+    their rates) in line with the patched tree, computed as the builder does.
+    """
+    stat_path = os.path.join(output_path, 'stats', f'{transaction_hash}_stat.json')
+    stats = read_json(stat_path)
+    if not stats:
+        return
+    total_nodes = stats.get('total_nodes', 0)
+    stats['total_name_matches'] = stats.get('total_name_matches', 0) + matched_delta
+    stats['total_missing'] = total_nodes - stats['total_name_matches'] if total_nodes > 0 else 0
+    stats['missing_rate'] = round(stats['total_missing'] / total_nodes * 100, 2) if total_nodes > 0 else 0
+    stats['total_ignored'] = stats.get('total_ignored', 0) + ignored_delta
+    stats['ignore_rate'] = round(stats['total_ignored'] / total_nodes * 100, 2) if total_nodes > 0 else 0
+    write_json(stat_path, stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Re-decode raw selectors left in built action trees using an updated selector database.')
+    parser.add_argument('--output-path', required=True,
+                        help='Output directory of parsing_tree_eventless.py (containing actiontree/ and unresolved/)')
+    parser.add_argument('--cache-path', required=False, default=SELECTOR_DATABASE_PATH,
+                        help='Path to the selector database JSON')
+    args = parser.parse_args()
+    main(args.output_path, args.cache_path)
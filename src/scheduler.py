@@ -0,0 +1,138 @@
+import os
+import time
+import functools
+import multiprocessing
+import concurrent.futures
+from tqdm import tqdm
+
+
+def default_max_workers():
+    """Same default as concurrent.futures.ThreadPoolExecutor."""
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def run_bounded(fn, items, max_workers=None, max_in_flight=None, total=None, desc="Processing", unit="txn"):
+    """
+    Run fn over items on a thread pool while keeping at most max_in_flight
+    submitted-but-unfinished tasks. Items are pulled lazily from the iterable,
+    so memory stays flat however many items it yields.
+
+    Yields (item, result, error) in completion order; error is the exception
+    raised by fn, or None on success. Progress and throughput are reported
+    with tqdm and summarised once all items are done.
+    """
+    max_workers = max_workers or default_max_workers()
+    max_in_flight = max(max_in_flight or 4 * max_workers, max_workers)
+
+    item_iter = iter(items)
+    pending = {}
+    completed = 0
+    start_time = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            tqdm(total=total, desc=desc, unit=unit) as pbar:
+
+        def refill():
+            while len(pending) < max_in_flight:
+                try:
+                    item = next(item_iter)
+                except StopIteration:
+                    return
+                pending[executor.submit(fn, item)] = item
+
+        refill()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                completed += 1
+                pbar.update(1)
+                yield item, result, error
+            refill()
+            pbar.set_postfix(in_flight=len(pending))
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    if completed:
+        print(f"{desc}: {completed} {unit} in {elapsed:.1f}s ({completed / elapsed:.2f} {unit}/s)")
+
+
+def largest_first(items, cost_of):
+    """
+    Longest-processing-time ordering: sort items by estimated cost, largest first.
+    Combined with run_bounded, whose idle workers always pull the next queued
+    item, the biggest transactions start early instead of straggling at the end
+    of a batch while the other workers sit idle.
+    """
+    return sorted(items, key=cost_of, reverse=True)
+
+
+def file_size_or_zero(path):
+    """Cheap cost estimate for a transaction: the size of its JSON file on disk."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _call_capturing(fn, item):
+    try:
+        return item, fn(item), None
+    except Exception as e:
+        return item, None, e
+
+
+# The function run_forked's workers call. It is set before the pool forks, so the workers
+# inherit it with everything it references (e.g. an Embedder over a memory-mapped store)
+# instead of receiving a pickled copy with every task.
+_forked_fn = None
+
+
+def _call_forked(item):
+    return _call_capturing(_forked_fn, item)
+
+
+def run_forked(fn, items, workers=1, total=None, desc="Processing", unit="file", ordered=False, chunksize=1):
+    """
+    Run fn over items in a pool of `workers` forked processes; with workers <= 1
+    everything runs in this process. Whatever the parent has loaded before the
+    call (the fastText model, a memory-mapped embedding store, caches) is
+    inherited by the workers copy-on-write instead of being loaded once per
+    worker, so RAM does not grow with the worker count. fn itself is inherited
+    too and never pickled, so it may close over unpicklable state; only the
+    items and the results cross process boundaries.
+
+    Yields (item, result, error) in completion order, like run_bounded, or in
+    the order of items if ordered is set, so that aggregated output does not
+    depend on the worker count. chunksize items are sent to a worker at a time.
+    """
+    global _forked_fn
+    start_time = time.time()
+    completed = 0
+
+    with tqdm(total=total, desc=desc, unit=unit) as pbar:
+        if workers <= 1:
+            outcomes = map(functools.partial(_call_capturing, fn), items)
+            pool = None
+        else:
+            _forked_fn = fn
+            pool = multiprocessing.get_context("fork").Pool(workers)
+            imap = pool.imap if ordered else pool.imap_unordered
+            outcomes = imap(_call_forked, items, chunksize)
+        try:
+            for outcome in outcomes:
+                completed += 1
+                pbar.update(1)
+                yield outcome
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+                _forked_fn = None
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    if completed:
+        print(f"{desc}: {completed} {unit} in {elapsed:.1f}s ({completed / elapsed:.2f} {unit}/s)")
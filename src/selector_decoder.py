@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
-import json
+import json_codec
 import os
 
+# Selector database read by the builders (path relative to the repository root).
+SELECTOR_DATABASE_PATH = './cache/selector_datsabase.json'
 
-def decode_selector(data, cache_path='./cache/selector_datsabase.json'):
+
+def decode_selector(data, cache_path=SELECTOR_DATABASE_PATH):
     """
     Decode function selectors in the provided data list using a local JSON mapping.
 
@@ -22,11 +25,7 @@ def decode_selector(data, cache_path='./cache/selector_datsabase.json'):
     Returns:
         list of dict: The input list with an added 'name' field for each entry.
     """
-    if os.path.exists(cache_path):
-        with open(cache_path, 'r') as f:
-            selector_mapping = json.load(f)
-    else:
-        selector_mapping = {}
+    selector_mapping = load_selector_mapping(cache_path)
 
     for row in data:
         sel = row.get('hex')
@@ -44,6 +43,25 @@ def decode_selector(data, cache_path='./cache/selector_datsabase.json'):
     return data
 
 
+def load_selector_mapping(cache_path=SELECTOR_DATABASE_PATH):
+    """
+    Load the selector => signature mapping from cache_path, or an empty
+    mapping if the database has not been downloaded.
+    """
+    if os.path.exists(cache_path):
+        return json_codec.load(cache_path)
+    return {}
+
+
+def find_unresolved_selectors(data):
+    """
+    Return the sorted list of selectors that decode_selector kept as is,
+    i.e. those that were not found in the selector database.
+    """
+    return sorted({row['hex'] for row in data
+                   if row.get('hex') is not None and row.get('name') == row['hex']})
+
+
 # Example usage:
 if __name__ == "__main__":
     # Example input data
@@ -61,4 +79,4 @@ if __name__ == "__main__":
     #   "0x12345678": "approve(address,uint256)"
     # }
     decoded = decode_selector(example_data)
-    print(json.dumps(decoded, indent=4))
+    print(json_codec.dumps(decoded))
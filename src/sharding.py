@@ -0,0 +1,56 @@
+import os
+import json_codec
+import hashlib
+
+
+def shard_of(tx_hash, num_shards):
+    """
+    Deterministically map a transaction hash to a shard in [0, num_shards),
+    using the first 32 bits after the 0x prefix. Names that are not hex fall
+    back to a digest of the whole string so every input still has a home.
+    """
+    prefix = tx_hash[2:] if tx_hash.startswith('0x') else tx_hash
+    try:
+        value = int(prefix[:8], 16)
+    except ValueError:
+        value = int(hashlib.sha1(tx_hash.encode()).hexdigest()[:8], 16)
+    return value % num_shards
+
+
+def in_shard(tx_hash, shard_index, num_shards):
+    """True if tx_hash belongs to shard_index; everything belongs to a single shard."""
+    if num_shards <= 1:
+        return True
+    return shard_of(tx_hash, num_shards) == shard_index
+
+
+def add_shard_arguments(parser):
+    """Register the --num-shards/--shard-index options shared by the batch scripts."""
+    parser.add_argument('--num-shards', type=int, default=1,
+                        help='Split the input into this many hash-partitioned shards (default: 1, no sharding).')
+    parser.add_argument('--shard-index', type=int, default=0,
+                        help='Index of the shard processed by this run, in [0, num-shards).')
+
+
+def check_shard_arguments(parser, args):
+    if args.num_shards < 1 or not 0 <= args.shard_index < args.num_shards:
+        parser.error('--shard-index must be in [0, --num-shards)')
+
+
+def tx_hash_of(file_path):
+    """Transaction hash of an action tree / trace file, taken from its file name."""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def write_shard_verdicts(file_path, shard_index, num_shards, verdicts):
+    """
+    Save one shard's detection verdicts, a dict mapping verdict name
+    (e.g. 'detected', 'not_detected', 'errors') to transaction hashes,
+    so that merge_shards.py can combine them exactly.
+    """
+    record = {
+        'shard_index': shard_index,
+        'num_shards': num_shards,
+        'verdicts': {name: sorted(hashes) for name, hashes in verdicts.items()},
+    }
+    json_codec.dump(record, file_path)
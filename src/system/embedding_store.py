@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import logging
+import numpy as np
+from glob import glob
+from tqdm import tqdm
+
+# The src folder holds the shared JSON codec; appended so it never shadows this folder's modules.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import json_codec
+
+DEFAULT_STORE_PATH = './cache/embedding_store'
+VECTORS_FILE = 'vectors.npy'
+VOCAB_FILE = 'vocab.json'
+# Present only in compact stores (see compact_store).
+SCALES_FILE = 'scales.npy'
+PROJECTION_FILE = 'projection.npy'
+# Raw dot products of every name with each of DETECTOR_KEYWORDS (see keyword_table).
+KEYWORD_DOTS_FILE = 'keyword_dots.npy'
+# The fastText model the store was built with: {"model_file": path or null for
+# cc.en.300.bin, "dim": its dimension}. Unseen names must be embedded with it.
+MODEL_INFO_FILE = 'model.json'
+
+# Names the system detectors embed besides the action names found in the trees.
+DETECTOR_KEYWORDS = ["swap", "fillOrder", "exchange", "ether_transfer"]
+
+# fastText models shared by every detector in the process, by model file (None for
+# cc.en.300.bin), each loaded on first use.
+_fasttext_models = {}
+# Embedder used by detectors called without one (see default_embedder).
+_default_embedder = None
+
+
+class EmbeddingStore:
+    """
+    Read-only table mapping action names to their raw (not mean-adjusted) fastText
+    sentence vectors, stored as a float32 .npy matrix next to a JSON list of names.
+
+    The matrix is opened with mmap, so every process reading the same store, including
+    forked workers and concurrent runs, shares a single copy through the page cache,
+    and only the rows actually used are read from disk.
+
+    A compact store (see compact_store) may hold int8 rows with one float32 scale per
+    row, and/or vectors projected to fewer dimensions; project() maps a full fastText
+    vector for an unseen name into the same space.
+
+    Next to the vectors, the store keeps the raw dot product of every name with each of
+    DETECTOR_KEYWORDS, so the POMA keyword similarities are a table lookup.
+
+    model_info records the fastText model the vectors come from (see MODEL_INFO_FILE);
+    stores built before it was recorded have none and were built with cc.en.300.bin.
+    """
+
+    def __init__(self, names, vectors, scales=None, projection=None, keyword_dots=None, model_info=None):
+        self.vectors = vectors
+        self.scales = scales
+        self.projection = projection
+        self.keyword_dots = keyword_dots
+        self.model_info = model_info
+        self.index = {name: row for row, name in enumerate(names)}
+
+    @classmethod
+    def open(cls, store_path=DEFAULT_STORE_PATH):
+        """Open the store at store_path, or return None if it has not been built."""
+        vectors_path = os.path.join(store_path, VECTORS_FILE)
+        vocab_path = os.path.join(store_path, VOCAB_FILE)
+        if not (os.path.exists(vectors_path) and os.path.exists(vocab_path)):
+            return None
+        names = json_codec.load(vocab_path)
+        scales_path = os.path.join(store_path, SCALES_FILE)
+        projection_path = os.path.join(store_path, PROJECTION_FILE)
+        keyword_dots_path = os.path.join(store_path, KEYWORD_DOTS_FILE)
+        scales = np.load(scales_path, mmap_mode='r') if os.path.exists(scales_path) else None
+        projection = np.load(projection_path) if os.path.exists(projection_path) else None
+        keyword_dots = np.load(keyword_dots_path, mmap_mode='r') if os.path.exists(keyword_dots_path) else None
+        model_info_path = os.path.join(store_path, MODEL_INFO_FILE)
+        model_info = json_codec.load(model_info_path) if os.path.exists(model_info_path) else None
+        return cls(names, np.load(vectors_path, mmap_mode='r'), scales, projection, keyword_dots, model_info)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return list(self.index)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    @property
+    def model_file(self):
+        """The fastText model file the store was built with, or None for cc.en.300.bin."""
+        return (self.model_info or {}).get('model_file')
+
+    @property
+    def model_dim(self):
+        """Dimension of the fastText vectors, before any projection."""
+        return self.projection.shape[0] if self.projection is not None else self.dim
+
+    @property
+    def nbytes(self):
+        """Size of the vector data (rows, scales, projection and keyword table)."""
+        arrays = (self.vectors, self.scales, self.projection, self.keyword_dots)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def get(self, name):
+        """The stored vector for name, or None if the name was not embedded."""
+        row = self.index.get(name)
+        if row is None:
+            return None
+        if self.scales is not None:
+            return self.vectors[row].astype(np.float32) * self.scales[row]
+        return np.asarray(self.vectors[row])
+
+    def keyword_dots_of(self, name, keywords):
+        """
+        Raw dot products of name's vector with each of keywords (all from DETECTOR_KEYWORDS),
+        or None if the name is not in the store or the store has no keyword table.
+        """
+        row = self.index.get(name)
+        if row is None or self.keyword_dots is None:
+            return None
+        return np.asarray(self.keyword_dots[row])[[DETECTOR_KEYWORDS.index(kw) for kw in keywords]]
+
+    def project(self, vector):
+        """Map a full fastText vector into this store's space (a no-op unless it is projected)."""
+        if self.projection is None:
+            return vector
+        return (vector @ self.projection).astype(np.float32)
+
+    def matrix(self):
+        """All stored vectors as a float32 matrix, dequantized if needed."""
+        if self.scales is not None:
+            return self.vectors.astype(np.float32) * np.asarray(self.scales)[:, None]
+        return np.asarray(self.vectors, dtype=np.float32)
+
+
+def keyword_table(names, vectors):
+    """Raw dot products (float64) of every row of vectors with the rows of DETECTOR_KEYWORDS."""
+    rows = [names.index(kw) for kw in DETECTOR_KEYWORDS]
+    vectors = np.asarray(vectors, dtype=np.float64)
+    return vectors @ vectors[rows].T
+
+
+def save_store(store_path, names, vectors, scales=None, projection=None, keyword_dots=None, model_info=None):
+    """
+    Write a store atomically. Builds only ever append names, so the vectors file is
+    replaced before the vocabulary: a reader racing a rebuild sees either the old or
+    the new vocabulary, and both index valid rows of the new matrix.
+    keyword_dots defaults to the keyword_table of the (dequantized) vectors.
+    model_info is written to MODEL_INFO_FILE when given.
+    """
+    if keyword_dots is None:
+        dequantized = vectors if scales is None else vectors.astype(np.float32) * np.asarray(scales)[:, None]
+        keyword_dots = keyword_table(names, dequantized)
+    os.makedirs(store_path, exist_ok=True)
+    vectors_path = os.path.join(store_path, VECTORS_FILE)
+    vocab_path = os.path.join(store_path, VOCAB_FILE)
+
+    for filename, array in ((SCALES_FILE, scales), (PROJECTION_FILE, projection), (KEYWORD_DOTS_FILE, keyword_dots)):
+        path = os.path.join(store_path, filename)
+        if array is None:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        with open(path + '.tmp', 'wb') as file:
+            np.save(file, np.asarray(array))
+        os.replace(path + '.tmp', path)
+
+    if model_info is not None:
+        model_info_path = os.path.join(store_path, MODEL_INFO_FILE)
+        json_codec.dump(model_info, model_info_path + '.tmp')
+        os.replace(model_info_path + '.tmp', model_info_path)
+
+    with open(vectors_path + '.tmp', 'wb') as file:
+        np.save(file, vectors if vectors.dtype == np.int8 else np.asarray(vectors, dtype=np.float32))
+    json_codec.dump(names, vocab_path + '.tmp', indent=None)
+    os.replace(vectors_path + '.tmp', vectors_path)
+    os.replace(vocab_path + '.tmp', vocab_path)
+
+
+def load_fasttext_model(cache_dir='./cache', model_file=None):
+    """
+    Load the fastText model used by the detectors: by default the English cc.en.300.bin,
+    downloaded into cache_dir if needed, or any other .bin/.ftz model given as model_file
+    (e.g. one reduced with fasttext.util.reduce_model).
+    """
+    import fasttext
+    import fasttext.util
+
+    if model_file is not None:
+        return fasttext.load_model(model_file)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    original_dir = os.getcwd()
+    os.chdir(cache_dir)
+    fasttext.util.download_model('en', if_exists='ignore')
+    os.chdir(original_dir)
+    return fasttext.load_model(os.path.join(cache_dir, 'cc.en.300.bin'))
+
+
+def get_fasttext_model(cache_dir='./cache', model_file=None):
+    """
+    The process-wide fastText model (cc.en.300.bin, or model_file), loaded on the first call.
+    Detectors only call this for names missing from the embedding store, so runs whose
+    vocabulary is fully pre-embedded never pay the multi-GB load.
+    """
+    if model_file not in _fasttext_models:
+        logging.info("Loading the fastText model %s", model_file or os.path.join(cache_dir, 'cc.en.300.bin'))
+        _fasttext_models[model_file] = load_fasttext_model(cache_dir, model_file)
+    return _fasttext_models[model_file]
+
+
+class Embedder:
+    """
+    Embeds action names for the detectors: names are read from an EmbeddingStore when it has
+    them and embedded with the (lazily loaded, process-wide) fastText model otherwise, then
+    cached. Each Embedder owns its caches, so detectors keep no module-level state; share one
+    Embedder across trees (and forked workers) to reuse vectors between files.
+
+    With allow_model_load False, a name missing from the store raises LookupError unless the
+    model is already loaded, so forked workers fail fast instead of each loading a copy.
+    """
+
+    def __init__(self, store=None, allow_model_load=True):
+        self.store = store
+        self.allow_model_load = allow_model_load
+        self.cache = {}
+        self.affinity_cache = {}
+
+    @classmethod
+    def from_path(cls, store_path=DEFAULT_STORE_PATH):
+        store = EmbeddingStore.open(store_path)
+        if store is None:
+            logging.warning("No embedding store at %s; embedding every name with fastText.", store_path)
+        return cls(store)
+
+    def model(self, func_name=None):
+        """
+        The fastText model embedding names missing from the store, loaded on first use: the
+        model the store was built with, so that every vector lives in the same space.
+        Raises FileNotFoundError if that model file is gone and ValueError if the model's
+        dimension does not match the store.
+        """
+        model_file = self.store.model_file if self.store is not None else None
+        if model_file not in _fasttext_models:
+            if not self.allow_model_load:
+                raise LookupError(f"{func_name!r} is not in the embedding store and the fastText model was not "
+                                  f"preloaded; extend the store or drop --no-preload-model")
+            if model_file is not None and not os.path.exists(model_file):
+                raise FileNotFoundError(f"The embedding store was built with {model_file}, which is not available; "
+                                        f"names missing from the store cannot be embedded in the same space")
+        model = get_fasttext_model(model_file=model_file)
+        if self.store is not None and model.get_dimension() != self.store.model_dim:
+            raise ValueError(f"The fastText model {model_file or 'cc.en.300.bin'} has dimension "
+                             f"{model.get_dimension()}, but the embedding store holds {self.store.model_dim}-dimensional "
+                             f"vectors; use the model the store was built with")
+        return model
+
+    def __call__(self, func_name):
+        """
+        Get the embedding vector for a function name. Names found in the store are read from it;
+        only unseen names are embedded with fastText's get_sentence_vector (which handles
+        multi-word names) and mapped into the store's space.
+        """
+        embedding = self.cache.get(func_name)
+        if embedding is None:
+            embedding = self.store.get(func_name) if self.store is not None else None
+            if embedding is None:
+                embedding = self.model(func_name).get_sentence_vector(func_name)
+                if self.store is not None:
+                    embedding = self.store.project(embedding)
+            self.cache[func_name] = embedding
+        return embedding
+
+    def keyword_dots(self, func_names, keywords):
+        """
+        Raw dot products of each name's embedding with each keyword, one row per name.
+        Rows are read from the store's keyword table; names missing from it are computed
+        once from their embedding and cached, so the table grows as new names appear.
+        """
+        cache = self.affinity_cache.setdefault(tuple(keywords), {})
+        rows = np.empty((len(func_names), len(keywords)))
+        keyword_vectors = None
+        for idx, func_name in enumerate(func_names):
+            row = cache.get(func_name)
+            if row is None:
+                row = self.store.keyword_dots_of(func_name, keywords) if self.store is not None else None
+                if row is None:
+                    if keyword_vectors is None:
+                        keyword_vectors = np.array([self(kw) for kw in keywords], dtype=np.float64)
+                    row = keyword_vectors @ np.asarray(self(func_name), dtype=np.float64)
+                cache[func_name] = row
+            rows[idx] = row
+        return rows
+
+
+def default_embedder():
+    """The process-wide Embedder over the store at DEFAULT_STORE_PATH, for callers that do not pass one."""
+    global _default_embedder
+    if _default_embedder is None:
+        _default_embedder = Embedder.from_path(DEFAULT_STORE_PATH)
+    return _default_embedder
+
+
+def prepare_forked_embedder(embedder, workers, preload=True):
+    """
+    Get embedder ready to be shared by `workers` forked processes. The fastText model is loaded
+    once in the parent, so workers share its pages copy-on-write instead of each loading its own
+    copy on the first name missing from the store. With preload False (the store is expected to
+    cover the corpus) workers fail on a missing name instead; without a store the model is
+    always preloaded.
+    """
+    if workers <= 1:
+        return
+    if preload or embedder.store is None:
+        embedder.model()
+    else:
+        embedder.allow_model_load = False
+
+
+def add_preload_arguments(parser):
+    """Register the model preloading option shared by the forking batch scripts."""
+    parser.add_argument("--no-preload-model", action="store_true",
+                        help="With --workers > 1, do not load the fastText model before forking; workers then fail "
+                             "on names missing from the embedding store instead of each loading their own copy.")
+
+
+def collect_action_names(node, names):
+    """Add the action name of every function call node in the tree to names."""
+    if node.get("type") == "function" and "sender" in node and "receiver" in node and "action" in node:
+        names.add(node["action"])
+    for child in node.get("nodes", []):
+        collect_action_names(child, names)
+
+
+def build_store(input_paths, store_path=DEFAULT_STORE_PATH, cache_dir='./cache', model_file=None):
+    """
+    Embed the vocabulary of all action trees under input_paths, plus DETECTOR_KEYWORDS,
+    and save it to store_path. An existing store is extended: only names it does not
+    contain yet are embedded, and existing rows keep their position.
+    """
+    names = set(DETECTOR_KEYWORDS)
+    file_paths = [file_path for input_path in input_paths
+                  for file_path in glob(os.path.join(input_path, "*.json"))]
+    for file_path in tqdm(file_paths, desc="Collecting action names", unit="file"):
+        collect_action_names(json_codec.load(file_path), names)
+
+    store = EmbeddingStore.open(store_path)
+    known_names = store.names() if store is not None else []
+    new_names = sorted(names.difference(known_names))
+    print(f"{len(names)} names in corpus, {len(known_names)} already stored, {len(new_names)} to embed.")
+    if not new_names:
+        return
+
+    if store is not None and (store.scales is not None or store.projection is not None):
+        raise ValueError(f"{store_path} is a compact store; extend the full store and compact it again")
+    if store is not None and store.model_file != model_file:
+        raise ValueError(f"{store_path} was built with {store.model_file or 'cc.en.300.bin'}; "
+                         f"extend it with the same model (--model-file) so all vectors share one space")
+
+    model = load_fasttext_model(cache_dir, model_file)
+    new_vectors = np.array([model.get_sentence_vector(name)
+                            for name in tqdm(new_names, desc="Embedding names", unit="name")], dtype=np.float32)
+    keyword_dots = None
+    if store is not None and store.keyword_dots is not None:
+        # Extend the keyword table with the new rows only; the keywords are always
+        # in the store, so their vectors are never re-embedded.
+        keyword_rows = np.array([store.get(kw) for kw in DETECTOR_KEYWORDS], dtype=np.float64)
+        keyword_dots = np.concatenate([np.asarray(store.keyword_dots),
+                                       new_vectors.astype(np.float64) @ keyword_rows.T])
+    if store is not None:
+        new_vectors = np.concatenate([store.matrix(), new_vectors])
+    model_info = {'model_file': model_file, 'dim': model.get_dimension()}
+    save_store(store_path, known_names + new_names, new_vectors, keyword_dots=keyword_dots, model_info=model_info)
+    print(f"Saved {len(known_names) + len(new_names)} embeddings to {store_path}")
+
+
+def compact_store(store_path, output_path, dims=None, int8=False):
+    """
+    Write a smaller copy of the store at store_path to output_path:
+      - dims: project the vectors onto their top `dims` principal axes, fitted on the
+        store's vocabulary. The projection is linear and kept in the store, so
+        fastText vectors of unseen names and per-tree mean centering map consistently.
+      - int8: quantize every row symmetrically to int8 with its own float32 scale.
+    Use test/compare_embedding_stores.py to measure the effect on detector verdicts.
+    """
+    store = EmbeddingStore.open(store_path)
+    if store is None:
+        raise FileNotFoundError(f"No embedding store at {store_path}")
+    if store.scales is not None or store.projection is not None:
+        raise ValueError(f"{store_path} is already compact; compact the full store instead")
+
+    vectors = store.matrix()
+    projection = None
+    if dims is not None:
+        dims = min(dims, *vectors.shape)
+        centered = vectors - vectors.mean(axis=0)
+        _, _, components = np.linalg.svd(centered, full_matrices=False)
+        projection = components[:dims].T.astype(np.float32)
+        explained = np.linalg.norm(centered @ projection) ** 2 / max(np.linalg.norm(centered) ** 2, 1e-12)
+        print(f"PCA {vectors.shape[1]} -> {dims} dims keeps {explained:.1%} of the vocabulary variance")
+        vectors = vectors @ projection
+
+    scales = None
+    if int8:
+        scales = (np.abs(vectors).max(axis=1) / 127).astype(np.float32)
+        scales[scales == 0] = 1
+        vectors = np.round(vectors / scales[:, None]).astype(np.int8)
+
+    save_store(output_path, store.names(), vectors, scales, projection, model_info=store.model_info)
+    compact = EmbeddingStore.open(output_path)
+    print(f"Saved {len(compact)} embeddings to {output_path}: "
+          f"{store.nbytes / 2**20:.1f} MiB -> {compact.nbytes / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build, extend or compact the persistent action-name embedding store used by poma.py and reentrancy.py.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Embed the action names of a corpus (extends an existing store)')
+    build.add_argument("--input-path", nargs='+', required=True,
+                       help="Folder(s) of action tree JSON files whose action names should be embedded")
+    build.add_argument("--store-path", default=DEFAULT_STORE_PATH, help="Embedding store folder")
+    build.add_argument("--cache-dir", default='./cache', help="Folder holding the fastText model")
+    build.add_argument("--model-file", default=None,
+                       help="Use this fastText .bin/.ftz model instead of cc.en.300.bin")
+
+    compact = subparsers.add_parser('compact', help='Write a PCA-reduced and/or int8-quantized copy of a store')
+    compact.add_argument("--store-path", default=DEFAULT_STORE_PATH, help="Full embedding store folder")
+    compact.add_argument("--output-path", required=True, help="Compact embedding store folder")
+    compact.add_argument("--dims", type=int, default=None, help="Keep this many principal dimensions (e.g. 64)")
+    compact.add_argument("--int8", action="store_true", help="Quantize the vectors to int8 with per-row scales")
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_store(args.input_path, args.store_path, args.cache_dir, args.model_file)
+    else:
+        if args.dims is None and not args.int8:
+            parser.error('compact needs --dims and/or --int8')
+        compact_store(args.store_path, args.output_path, args.dims, args.int8)
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
-import json
-import argparse
 import os
+import sys
+import bisect
+import argparse
 import numpy as np
-import fasttext
-import fasttext.util
 import logging
+# The src folder holds the shared JSON codec; appended so it never shadows this folder's modules.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import json_codec
+from embedding_store import Embedder, DEFAULT_STORE_PATH, default_embedder
+from traversal import walk_preorder
+from similarity import name_table, mean_centered_norms, keyword_cosines
+from results import TripleCollector, DetectionBudget, RESULT_MODES, add_budget_arguments, check_result_arguments
 
 # Configure logging to file "log.log"
 logging.basicConfig(
@@ -15,101 +21,48 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Global counter for preorder order and embedding cache.
-order_counter = 1
-embedding_cache = {}
-
-# Initialize fastText model.
-cache_dir = './cache'
-os.makedirs(cache_dir, exist_ok=True)
-original_dir = os.getcwd()
-os.chdir(cache_dir)
-fasttext.util.download_model('en', if_exists='ignore')
-os.chdir(original_dir)
-fasttext_model_path = os.path.join(cache_dir, 'cc.en.300.bin')
-fasttext_model = fasttext.load_model(fasttext_model_path)
-
-def get_embedding(func_name: str) -> np.ndarray:
-    """
-    Get the embedding vector for a function name using fastText.
-    Uses get_sentence_vector to handle multi-word names.
-    Caches the result to avoid repeated calculations.
-    """
-    if func_name in embedding_cache:
-        return embedding_cache[func_name]
-    embedding = fasttext_model.get_sentence_vector(func_name)
-    embedding_cache[func_name] = embedding
-    return embedding
-
-def cosine_similarity(vec1, vec2):
-    """
-    Compute the cosine similarity between two vectors.
-    Returns 0 if either vector has zero norm.
-    """
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-    if norm1 == 0 or norm2 == 0:
-        return 0
-    return np.dot(vec1, vec2) / (norm1 * norm2)
+# Keywords call names are compared against: swap-like calls, then the ether transfer.
+SWAP_KEYWORDS = ["swap", "fillOrder", "exchange"]
+ETHER_KEYWORD = "ether_transfer"
 
-def traverse_tree(node, depth, calls, ignore_static_delegate=False):
+def call_record(node, order, depth, ignore_static_delegate=False):
     """
-    Traverse the action tree in preorder, assign order and depth,
-    and record all function call nodes (with keys: sender, receiver, action).
-    Calculate and attach the word embedding for the function name.
-    If ignore_static_delegate is True, ignore nodes with call_type 'staticcall' or 'delegatecall'.
+    The call record (order, depth, sender, receiver, function) of a node visited at (order, depth),
+    or None unless it is a function call node with keys sender, receiver and action.
+    If ignore_static_delegate is True, nodes with call_type 'staticcall' or 'delegatecall' give None.
     """
-    global order_counter
-    current_order = order_counter
-    order_counter += 1
-
-    # Annotate the node.
-    node["order"] = current_order
-    node["depth"] = depth
-
-    # Check if we should ignore staticcall/delegatecall nodes.
     call_type = node.get("call_type")
     if ignore_static_delegate and call_type in {"staticcall", "delegatecall"}:
-        logging.debug("Ignoring node order %d, depth %d with call_type '%s'", current_order, depth, call_type)
-        # Still traverse its children even if this node is ignored.
-        for child in node.get("nodes", []):
-            traverse_tree(child, depth + 1, calls, ignore_static_delegate)
-        return
-
-    # If the node is a function call and has necessary info, record it.
+        logging.debug("Ignoring node order %d, depth %d with call_type '%s'", order, depth, call_type)
+        return None
     if node.get("type") == "function" and "sender" in node and "receiver" in node and "action" in node:
-        func_name = node["action"]
-        emb = get_embedding(func_name)
-        node["embedding"] = emb
-        call_info = {
-            "order": current_order,
+        return {
+            "order": order,
             "depth": depth,
             "sender": node["sender"],
             "receiver": node["receiver"],
-            "function": func_name,
-            "embedding": emb
+            "function": node["action"]
         }
-        calls.append(call_info)
-        logging.debug("Recorded call: order %d, depth %d, sender %s, receiver %s, function '%s'",
-                      current_order, depth, node["sender"], node["receiver"], func_name)
-
-    # Recurse into children.
-    for child in node.get("nodes", []):
-        traverse_tree(child, depth + 1, calls, ignore_static_delegate)
+    return None
 
-def adjust_embeddings(calls):
+def collect_calls(tree, ignore_static_delegate=False):
     """
-    Compute the average embedding of all calls and subtract it from each call's embedding.
+    Traverse the action tree in preorder, assign order and depth (root: order 1, depth 1),
+    and return the records of all function call nodes (see call_record), in traversal order.
+    The tree is left unmodified and no state outlives the call; embeddings are looked up
+    per unique function name by detect_poma.
     """
-    if not calls:
-        return
-    all_embeddings = np.array([call["embedding"] for call in calls])
-    avg_embedding = np.mean(all_embeddings, axis=0)
-    for call in calls:
-        call["embedding"] = call["embedding"] - avg_embedding
-    logging.debug("Adjusted all embeddings by subtracting the average embedding.")
-
-def detect_poma(calls, threshold_swap=0.5, threshold_ether=0):
+    calls = []
+    for node, order, depth in walk_preorder(tree):
+        call_info = call_record(node, order, depth, ignore_static_delegate)
+        if call_info is not None:
+            calls.append(call_info)
+            logging.debug("Recorded call: order %d, depth %d, sender %s, receiver %s, function '%s'",
+                          order, depth, call_info["sender"], call_info["receiver"], call_info["function"])
+    return calls
+
+def detect_poma(calls, threshold_swap=0.5, threshold_ether=0, mode="all", limit=None, budget=None, table=None,
+                embedder=None):
     """
     Detect Price Manipulation (POMA) pattern based on the following rules:
       1. There exist two calls, a and b, whose function names are similar to one of
@@ -118,80 +71,92 @@ def detect_poma(calls, threshold_swap=0.5, threshold_ether=0):
       2. They must have the same sender but different receivers.
       3. There exists a third call, c, with a function name similar to "ether_transfer" (cosine similarity > threshold_ether),
          and the orders satisfy: a.order < b.order < c.order.
-    Returns a tuple (detected: bool, list_of_triples: list).
-    All found triples are logged.
+
+    Call embeddings are centered on the tree's mean call embedding before being compared with the
+    keywords. Keyword and ether_transfer similarities are computed once per unique function name
+    from the raw name-keyword dot products (Embedder.keyword_dots, a table lookup for stored names),
+    with the centering applied algebraically (see similarity.py), and looked up by name id.
+
+    calls must be in traversal order, as produced by collect_calls. For each (a, b) pair, the
+    valid c are exactly the ether-like calls after b, found by binary search over their sorted orders.
+
+    mode and limit select the result (see results.TripleCollector):
+      - "all":    (detected, triples) with every valid triple, or at most limit triples if limit is set.
+      - "exists": (detected, [first triple]) stopping at the first valid triple.
+      - "count":  (detected, number of valid triples) without building any triple.
+      - "topk":   (detected, the limit triples with the highest summed swap and ether similarity).
+    When nothing is found, (False, None) is returned, or (False, 0) in "count" mode.
+
+    budget (a results.DetectionBudget) is started once the candidates are selected and charged one
+    comparison per candidate pair (a, b) and, for each valid pair, one per triple the result mode
+    examines (see TripleCollector.cost); once it is exhausted the search stops with the triples
+    found so far and budget.exceeded set.
+
+    table is the similarity.name_table of calls, if already built by the caller; otherwise it is built here.
+    embedder (an embedding_store.Embedder) embeds the names; default_embedder() if None.
     """
-    candidate_keywords = ["swap", "fillOrder", "exchange"]
-    # Pre-compute embeddings for candidate keywords.
-    candidate_embeddings = {kw: get_embedding(kw) for kw in candidate_keywords}
-    ether_transfer_emb = get_embedding("ether_transfer")
-    swap_candidates = []
-    valid_triples = []
-
-    # Identify candidates for swap-like calls.
-    for call in calls:
-        max_sim = 0
-        matched_kw = None
-        # Check similarity against each candidate keyword.
-        for kw, emb in candidate_embeddings.items():
-            sim = cosine_similarity(call["embedding"], emb)
-            if sim > max_sim:
-                max_sim = sim
-                matched_kw = kw
-        if max_sim > threshold_swap:
-            swap_candidates.append(call)
-            logging.debug("Call order %d considered candidate for %s (sim=%.4f): function=%s",
-                          call["order"], matched_kw, max_sim, call["function"])
-        else:
-            logging.debug("Call order %d rejected as candidate (max sim=%.4f): function=%s",
-                          call["order"], max_sim, call["function"])
-
-    n = len(swap_candidates)
-    for i in range(n):
-        a = swap_candidates[i]
-        for j in range(i + 1, n):
-            b = swap_candidates[j]
-            # Check depth condition: difference must be ≤ 1.
-            if abs(a["depth"] - b["depth"]) > 1:
-                logging.debug("Candidate pair rejected due to depth diff: orders %d and %d (depths: %d and %d)",
-                              a["order"], b["order"], a["depth"], b["depth"])
-                continue
-            # Check that both calls have the same sender and different receivers.
-            if a["sender"] != b["sender"]:
-                logging.debug("Candidate pair rejected due to sender mismatch: orders %d and %d (senders: %s vs %s)",
-                              a["order"], b["order"], a["sender"], b["sender"])
+    collector = TripleCollector(mode, limit)
+
+    if calls:
+        embedder = embedder or default_embedder()
+        keywords = SWAP_KEYWORDS + [ETHER_KEYWORD]
+        names, name_ids, vectors, weights = table if table is not None else name_table(calls, embedder)
+        keyword_norms = np.sqrt(np.diag(embedder.keyword_dots(keywords, keywords)))
+        sims = keyword_cosines(embedder.keyword_dots(names, keywords), weights,
+                               mean_centered_norms(vectors, weights), keyword_norms)
+        # Similarities below 0 never make a call a swap candidate.
+        swap_sim = np.maximum(sims[:, :-1].max(axis=1), 0)[name_ids]
+        ether_sim = sims[:, -1][name_ids]
+        swap_positions = np.flatnonzero(swap_sim > threshold_swap)
+        ether_positions = np.flatnonzero(ether_sim > threshold_ether)
+    else:
+        swap_positions = ether_positions = np.zeros(0, dtype=np.int64)
+    logging.debug("%d swap-like candidates, %d ether_transfer-like calls", len(swap_positions), len(ether_positions))
+    ether_orders = [calls[pos]["order"] for pos in ether_positions]
+
+    # Pairs must share a sender, so b is only searched among a's sender group.
+    by_sender = {}
+    for pos in swap_positions:
+        by_sender.setdefault(calls[pos]["sender"], []).append(pos)
+
+    if budget is not None:
+        budget.start()
+    for pos_a in swap_positions:
+        a = calls[pos_a]
+        group = by_sender[a["sender"]]
+        b_candidates = group[bisect.bisect_right(group, pos_a):]
+        if budget is not None and budget.charge(len(b_candidates)):
+            logging.warning("POMA budget exceeded after %d comparisons; %d triples found so far",
+                            budget.comparisons, collector.count)
+            return finish_poma(collector)
+        for pos_b in b_candidates:
+            b = calls[pos_b]
+            if abs(a["depth"] - b["depth"]) > 1 or a["receiver"] == b["receiver"]:
                 continue
-            if a["receiver"] == b["receiver"]:
-                logging.debug("Candidate pair rejected due to identical receivers: orders %d and %d (receiver: %s)",
-                              a["order"], b["order"], a["receiver"])
+            if not a["order"] < b["order"]:
                 continue
-
-            # For each valid a & b pair, look for a third call c for ether_transfer.
-            for c in calls:
-                if not (a["order"] < b["order"] < c["order"]):
-                    logging.debug("Candidate triple rejected due to order condition: orders a=%d, b=%d, c=%d",
-                                  a["order"], b["order"], c["order"])
-                    continue
-                sim_ether = cosine_similarity(c["embedding"], ether_transfer_emb)
-                if sim_ether > threshold_ether:
-                    valid_triples.append((a, b, c))
-                    logging.info("Valid triple found: a(order %d), b(order %d), c(order %d) | sim_ether=%.4f",
-                                 a["order"], b["order"], c["order"], sim_ether)
-                else:
-                    logging.debug("Candidate triple (a.order %d, b.order %d, c.order %d) rejected due to ether sim: %.4f",
-                                  a["order"], b["order"], c["order"], sim_ether)
-
-    if valid_triples:
-        logging.info("Total valid POMA triples detected: %d", len(valid_triples))
-        return True, valid_triples
-    else:
-        logging.info("No POMA triple detected.")
-        return False, None
+            c_positions = ether_positions[bisect.bisect_right(ether_orders, b["order"]):]
+            if budget is not None and budget.charge(collector.cost(len(c_positions))):
+                logging.warning("POMA budget exceeded after %d comparisons; %d triples found so far",
+                                budget.comparisons, collector.count)
+                return finish_poma(collector)
+            if collector.add_many(len(c_positions), lambda idx: (a, b, calls[c_positions[idx]]),
+                                  lambda: swap_sim[pos_a] + swap_sim[pos_b] + ether_sim[c_positions]):
+                return finish_poma(collector)
+    return finish_poma(collector)
+
+def finish_poma(collector):
+    """Shape the collected triples into detect_poma's (detected, result) return value."""
+    if collector.detected:
+        logging.info("Total valid POMA triples detected: %d (mode %s)", collector.count, collector.mode)
+        return True, collector.result()
+    logging.info("No POMA triple detected.")
+    return False, (0 if collector.mode == "count" else None)
 
 def main():
     parser = argparse.ArgumentParser(
         description=("Detect Price Manipulation (POMA) in an action tree JSON using function calls.\n\n"
-                     "The script traverses the tree (annotating each node with order and depth), calculates word embeddings for function names, "
+                     "The script traverses the tree (numbering nodes by preorder order and depth), calculates word embeddings for function names, "
                      "adjusts these embeddings, and then detects all valid POMA triples based on the following rules:\n"
                      "  1. There exist two calls whose function names are similar to one of ['swap', 'fillOrder', 'exchange'] with depth difference ≤ 1, "
                      "     with same sender and different receivers.\n"
@@ -201,21 +166,31 @@ def main():
     parser.add_argument("--ignore-static-delegate", action="store_true",
                         help="If set, nodes with call_type 'staticcall' or 'delegatecall' will be ignored during traversal.")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose mode to print detected candidate triples")
+    parser.add_argument("--result-mode", choices=RESULT_MODES, default="all",
+                        help="Report all triples, stop at the first one (exists), only count them, or keep the top-k by score.")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Maximum number of triples to keep ('all' and 'topk' modes).")
+    add_budget_arguments(parser)
+    parser.add_argument("--embedding-store", default=DEFAULT_STORE_PATH,
+                        help="Pre-computed action-name embeddings (built with embedding_store.py).")
     args = parser.parse_args()
+    check_result_arguments(parser, args)
+    embedder = Embedder.from_path(args.embedding_store)
 
     # Load the action tree from JSON.
-    with open(args.input_file, "r") as f:
-        tree = json.load(f)
+    tree = json_codec.load(args.input_file)
 
-    global order_counter
-    order_counter = 1  # Reset the order counter.
-    calls = []
-    traverse_tree(tree, depth=1, calls=calls, ignore_static_delegate=args.ignore_static_delegate)
-    adjust_embeddings(calls)
+    calls = collect_calls(tree, ignore_static_delegate=args.ignore_static_delegate)
 
-    detected, triples = detect_poma(calls)
+    budget = DetectionBudget(args.max_seconds, args.max_comparisons)
+    detected, triples = detect_poma(calls, mode=args.result_mode, limit=args.limit, budget=budget,
+                                   embedder=embedder)
+    if budget.exceeded:
+        print(f"Budget exceeded after {budget.comparisons} comparisons; the result below is partial.")
     if detected:
-        if args.verbose:
+        if args.verbose and args.result_mode == "count":
+            print(f"Price Manipulation detected! Found {triples} valid triples.")
+        elif args.verbose:
             print("Price Manipulation detected! Valid triples:")
             for idx, (a, b, c) in enumerate(triples, start=1):
                 print(f"Triple {idx}:")
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
-import json
-import argparse
 import os
+import sys
+import argparse
 import numpy as np
-import fasttext
-import fasttext.util
 import logging
+# The src folder holds the shared JSON codec; appended so it never shadows this folder's modules.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import json_codec
+from embedding_store import Embedder, DEFAULT_STORE_PATH, default_embedder
+from traversal import walk_preorder
+from similarity import name_table, centered_gram, centered_norms, centered_cosines
+from results import TripleCollector, DetectionBudget, RESULT_MODES, add_budget_arguments, check_result_arguments
 
 # Configure logging
 logging.basicConfig(
@@ -15,109 +20,57 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Global counter for preorder order and embedding cache.
-order_counter = 1
-embedding_cache = {}
-
-# Initialize fastText model.
-cache_dir = './cache'
-os.makedirs(cache_dir, exist_ok=True)
-
-# Download the fastText English model into the cache directory if not exists.
-original_dir = os.getcwd()
-os.chdir(cache_dir)
-fasttext.util.download_model('en', if_exists='ignore')
-os.chdir(original_dir)
-
-fasttext_model_path = os.path.join(cache_dir, 'cc.en.300.bin')
-fasttext_model = fasttext.load_model(fasttext_model_path)
-
-def get_embedding(func_name: str) -> np.ndarray:
-    """
-    Get the embedding vector for a function name using fastText.
-    Uses get_sentence_vector to handle multi-word names.
-    Caches the result so repeated calculations are avoided.
+def call_record(node, order, depth, ignore_static_delegate=False):
     """
-    if func_name in embedding_cache:
-        return embedding_cache[func_name]
-    # Compute embedding using the fastText model.
-    embedding = fasttext_model.get_sentence_vector(func_name)
-    embedding_cache[func_name] = embedding
-    return embedding
-
-def cosine_similarity(vec1, vec2):
+    The call record of a node visited at (order, depth) in preorder, or None if it is not a call.
+    A function call node has "type" "function" and contains sender, receiver, and action keys;
+    its record holds its order, depth, sender, receiver and function name.
+    If ignore_static_delegate is True, nodes with call_type "staticcall" or "delegatecall" are ignored (not calls),
+    though their children are still visited.
     """
-    Compute cosine similarity between two vectors.
-    Returns 0 if either vector is zero.
-    """
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-    if norm1 == 0 or norm2 == 0:
-        return 0
-    return np.dot(vec1, vec2) / (norm1 * norm2)
-
-def traverse_tree(node, depth, calls, ignore_static_delegate=False):
-    """
-    Traverse the action tree in preorder and assign order and depth.
-    If the node represents a function call (i.e., its "type" is "function" and it contains sender, receiver, and action keys),
-    calculate and store the embedding for its function name on the fly.
-    If ignore_static_delegate is True, nodes with call_type "staticcall" or "delegatecall" are ignored (not added as calls).
-    Then traverse its children under the "nodes" key.
-    """
-    global order_counter
-    current_order = order_counter
-    order_counter += 1
-
-    # Annotate the node with order and depth attributes.
-    node["order"] = current_order
-    node["depth"] = depth
-
-    # Check if we need to ignore this node based on its call_type.
     call_type = node.get("call_type")
     if ignore_static_delegate and call_type in {"staticcall", "delegatecall"}:
         logging.debug("Node order %d (depth %d) with call_type '%s' ignored during traversal.",
-                      current_order, depth, call_type)
-        # Traverse children even if node itself is ignored.
-        for child in node.get("nodes", []):
-            traverse_tree(child, depth + 1, calls, ignore_static_delegate)
-        return
-
-    # If the node is a function call, record its details and compute its function name embedding.
+                      order, depth, call_type)
+        return None
     if node.get("type") == "function" and "sender" in node and "receiver" in node and "action" in node:
-        func_name = node["action"]
-        # Compute and store the embedding.
-        original_embedding = get_embedding(func_name)
-        node["embedding"] = original_embedding  # temporary embedding, will be updated later.
-        call_info = {
-            "order": current_order,
+        return {
+            "order": order,
             "depth": depth,
             "sender": node["sender"],
             "receiver": node["receiver"],
-            "function": func_name,
-            "embedding": original_embedding
+            "function": node["action"]
         }
-        calls.append(call_info)
-        logging.debug("Added call: order %d, depth %d, sender %s, receiver %s, function %s",
-                      current_order, depth, node["sender"], node["receiver"], func_name)
-
-    # Traverse children if they exist.
-    for child in node.get("nodes", []):
-        traverse_tree(child, depth + 1, calls, ignore_static_delegate)
+    return None
 
-def adjust_embeddings(calls):
+def collect_calls(tree, ignore_static_delegate=False):
+    """
+    Traverse the action tree in preorder and assign order and depth (root: order 1, depth 1).
+    Return the record of every function call node (see call_record), in traversal order.
+    Embeddings are not attached: the detector looks them up once per unique function name
+    (see similarity.name_table). The tree is left unmodified and no state outlives the call,
+    so trees can be processed concurrently or in any order.
     """
-    Calculate the average embedding from all function calls,
-    then subtract the average from each call's embedding and update it.
+    calls = []
+    for node, order, depth in walk_preorder(tree):
+        call_info = call_record(node, order, depth, ignore_static_delegate)
+        if call_info is not None:
+            calls.append(call_info)
+            logging.debug("Added call: order %d, depth %d, sender %s, receiver %s, function %s",
+                          order, depth, call_info["sender"], call_info["receiver"], call_info["function"])
+    return calls
+
+def bucket_by(calls, key):
+    """
+    Group call indices by calls[i][key]. Each bucket is an index array in traversal
+    (i.e. preorder) order, so the orders within a bucket are sorted.
     """
-    if not calls:
-        return
-    all_embeddings = np.array([call["embedding"] for call in calls])
-    avg_embedding = np.mean(all_embeddings, axis=0)
-    for call in calls:
-        call["embedding"] = call["embedding"] - avg_embedding
-    logging.debug("Adjusted embeddings by subtracting the average embedding.")
-
-def detect_reentrancy(calls):
+    buckets = {}
+    for idx, call in enumerate(calls):
+        buckets.setdefault(call[key], []).append(idx)
+    return {value: np.array(indices, dtype=np.int64) for value, indices in buckets.items()}
+
+def detect_reentrancy(calls, mode="all", limit=None, budget=None, table=None, embedder=None):
     """
     Detect the reentrancy pattern based on the updated conditions:
       (1) There exist two calls call_A and call_B whose function names are similar,
@@ -130,65 +83,92 @@ def detect_reentrancy(calls):
     Instead of stopping at the first found triple, all valid triples are collected.
     Returns a list of tuples (call_A, call_B, call_C, sim_ab, sim_ac) where sim_ab is similarity between call_A and call_B,
     and sim_ac is similarity between call_A and call_C.
-    Detailed logging is performed for every candidate triple.
+
+    Embeddings are compared after subtracting the mean embedding of all calls in the tree.
+    Calls repeat the same few names, so the centered cosine similarities are computed once per
+    pair of unique names, from their Gram matrix (see similarity.py), and looked up by name id.
+
+    calls must be in traversal order, as produced by collect_calls. Candidate B calls are drawn only
+    from A's sender bucket and candidate C calls only from A's receiver bucket, cut to the calls after
+    A (or after B) by binary search on the sorted per-bucket orders, so the cost follows the number of
+    plausible triples rather than n^3. Triples are reported in the same (A, B, C) order as a plain
+    nested loop over calls.
+
+    mode and limit select the result (see results.TripleCollector): "all" returns the list above
+    (capped at limit triples if set), "exists" stops at the first triple, "count" returns only the
+    number of triples, and "topk" returns the limit triples with the largest sim(A,B) - sim(A,C).
+
+    budget (a results.DetectionBudget) is started once the similarities are computed and
+    charged one comparison per candidate B and C examined,
+    for each A and again for the C window of each similar B;
+    once it is exhausted the search stops and the triples found so far are returned, with
+    budget.exceeded set so the caller can tell a partial result from a complete one.
+
+    table is the similarity.name_table of calls, if the caller already built it (e.g. to share it
+    with detect_poma); otherwise it is built here, embedding names with embedder
+    (an embedding_store.Embedder, default_embedder() if None).
     """
-    valid_triples = []
+    collector = TripleCollector(mode, limit)
     n = len(calls)
+    if n == 0:
+        return collector.result()
+
+    _, name_ids, vectors, weights = table if table is not None else name_table(calls, embedder or default_embedder())
+    centered = centered_gram(vectors, weights)
+    cosines = centered_cosines(centered, centered_norms(vectors, centered))
+    orders = np.array([call["order"] for call in calls])
+    depths = np.array([call["depth"] for call in calls])
+    by_sender = bucket_by(calls, "sender")
+    by_receiver = bucket_by(calls, "receiver")
+
+    def candidates_after(bucket, i):
+        """Bucket members after call i in preorder and at least as deep as it."""
+        later = bucket[np.searchsorted(orders[bucket], orders[i], side="right"):]
+        return later[depths[later] >= depths[i]]
+
+    if budget is not None:
+        budget.start()
     for i in range(n):
         call_A = calls[i]
-        for j in range(n):
-            if i == j:
-                continue
+        b_indices = candidates_after(by_sender[call_A["sender"]], i)
+        if b_indices.size == 0:
+            continue
+        c_indices = candidates_after(by_receiver[call_A["receiver"]], i)
+        if c_indices.size == 0:
+            continue
+        if budget is not None and budget.charge(b_indices.size + c_indices.size):
+            logging.warning("Reentrancy budget exceeded after %d comparisons; %d triples found so far",
+                            budget.comparisons, collector.count)
+            return collector.result()
+        c_sims = cosines[name_ids[c_indices], name_ids[i]]
+        c_keep = c_sims < -0.1
+        c_indices, c_sims = c_indices[c_keep], c_sims[c_keep]
+        if c_indices.size == 0:
+            continue
+        b_sims = cosines[name_ids[b_indices], name_ids[i]]
+        b_keep = b_sims > 0.2
+        c_orders = orders[c_indices]
+        for j, sim_ab in zip(b_indices[b_keep], b_sims[b_keep]):
             call_B = calls[j]
-            # Log the pair being compared.
-            logging.debug("Evaluating pair: A(order %s, function '%s') and B(order %s, function '%s')",
-                          call_A["order"], call_A["function"],
-                          call_B["order"], call_B["function"])
-            # (1) Check that call_A and call_B's function names are similar and they have the same sender.
-            if call_A["sender"] != call_B["sender"]:
-                logging.debug("Pair rejected due to different senders: A sender %s, B sender %s",
-                              call_A["sender"], call_B["sender"])
-                continue
-            sim_ab = cosine_similarity(call_A["embedding"], call_B["embedding"])
-            if sim_ab <= 0.2:
-                logging.debug("Pair rejected due to low similarity (A,B): %.4f", sim_ab)
-                continue
-            # Ensure depth and order relationship for call_A and call_B.
-            if not (call_A["depth"] <= call_B["depth"] and call_A["order"] < call_B["order"]):
-                logging.debug("Pair rejected due to depth/order condition: A(depth %d, order %d), B(depth %d, order %d)",
-                              call_A["depth"], call_A["order"],
-                              call_B["depth"], call_B["order"])
-                continue
-            # (2) Look for call_C that is contradicting call_A and meets receiver condition.
-            for k in range(n):
-                if k == i or k == j:
-                    continue
-                call_C = calls[k]
-                sim_ac = cosine_similarity(call_A["embedding"], call_C["embedding"])
-                if sim_ac >= -0.1:
-                    logging.debug("Pair rejected due to low similarity (A,C): %.4f", sim_ac)
-                    continue
-                # Check if call_C's receiver is the same as call_A's receiver.
-                if call_C["receiver"] != call_A["receiver"]:
-                    logging.debug("Candidate C rejected due to receiver mismatch: A receiver %s, C receiver %s",
-                                  call_A["receiver"], call_C["receiver"])
-                    continue
-                # Check the depth and order conditions.
-                if call_A["depth"] <= call_C["depth"] <= call_B["depth"] and call_A["order"] < call_B["order"] < call_C["order"]:
-                    logging.info("Valid triple found: A(order %d), B(order %d), C(order %d) | sim(A,B)=%.4f, sim(A,C)=%.4f",
-                                 call_A["order"], call_B["order"], call_C["order"], sim_ab, sim_ac)
-                    valid_triples.append((call_A, call_B, call_C, sim_ab, sim_ac))
-                else:
-                    logging.debug("Candidate triple rejected due to depth/order condition: A(depth %d, order %d), C(depth %d, order %d), B(depth %d, order %d)",
-                                  call_A["depth"], call_A["order"],
-                                  call_C["depth"], call_C["order"],
-                                  call_B["depth"], call_B["order"])
-    return valid_triples
+            start = np.searchsorted(c_orders, orders[j], side="right")
+            if budget is not None and budget.charge(c_orders.size - start):
+                logging.warning("Reentrancy budget exceeded after %d comparisons; %d triples found so far",
+                                budget.comparisons, collector.count)
+                return collector.result()
+            c_within = depths[c_indices[start:]] <= depths[j]
+            ks, sims_ac = c_indices[start:][c_within], c_sims[start:][c_within]
+            if collector.add_many(len(ks), lambda idx: (call_A, call_B, calls[ks[idx]], sim_ab, sims_ac[idx]),
+                                  lambda: sim_ab - sims_ac):
+                logging.info("Stopped after %d reentrancy triples (mode %s)", collector.count, mode)
+                return collector.result()
+
+    logging.info("Valid reentrancy triples found: %d (mode %s)", collector.count, mode)
+    return collector.result()
 
 def main():
     parser = argparse.ArgumentParser(
         description=("Detect if an action tree JSON exhibits a reentrancy pattern with updated rules.\n\n"
-                     "Each node in the JSON tree is annotated with:\n"
+                     "Each node in the JSON tree is assigned:\n"
                      "  - order: the order from a preorder traversal.\n"
                      "  - depth: the level of the node in the tree (root is depth 1).\n\n"
                      "A function call node is defined as having type 'function' and containing the keys: sender, receiver, and action.\n"
@@ -206,26 +186,34 @@ def main():
     parser.add_argument(
         "--ignore-static-delegate", action="store_true",
         help="If set, nodes with call_type 'staticcall' or 'delegatecall' will be ignored during traversal.")
+    parser.add_argument(
+        "--result-mode", choices=RESULT_MODES, default="all",
+        help="Report all triples, stop at the first one (exists), only count them, or keep the top-k by score.")
+    parser.add_argument(
+        "--limit", type=int, default=None,
+        help="Maximum number of triples to keep ('all' and 'topk' modes).")
+    add_budget_arguments(parser)
+    parser.add_argument("--embedding-store", default=DEFAULT_STORE_PATH,
+                        help="Pre-computed action-name embeddings (built with embedding_store.py).")
     args = parser.parse_args()
+    check_result_arguments(parser, args)
+    embedder = Embedder.from_path(args.embedding_store)
 
     # Load the JSON tree.
-    with open(args.input_file, "r") as f:
-        tree = json.load(f)
-
-    # Reset the global order counter.
-    global order_counter
-    order_counter = 1
-
-    # Traverse the tree and record all function call nodes (with their embeddings).
-    calls = []
-    traverse_tree(tree, depth=1, calls=calls, ignore_static_delegate=args.ignore_static_delegate)
+    tree = json_codec.load(args.input_file)
 
-    # Adjust embeddings: subtract average embedding from each function call's embedding.
-    adjust_embeddings(calls)
+    # Traverse the tree and record all function call nodes.
+    calls = collect_calls(tree, ignore_static_delegate=args.ignore_static_delegate)
 
     # Detect the updated reentrancy pattern and collect all valid triples.
-    valid_triples = detect_reentrancy(calls)
-    if valid_triples:
+    budget = DetectionBudget(args.max_seconds, args.max_comparisons)
+    valid_triples = detect_reentrancy(calls, mode=args.result_mode, limit=args.limit, budget=budget,
+                                     embedder=embedder)
+    if budget.exceeded:
+        print(f"Budget exceeded after {budget.comparisons} comparisons; the result below is partial.")
+    if args.result_mode == "count":
+        print(f"Reentrancy detected! Found {valid_triples} valid triples." if valid_triples else "No reentrancy detected.")
+    elif valid_triples:
         print("Reentrancy detected! Found the following valid triples:\n")
         for idx, (call_A, call_B, call_C, sim_ab, sim_ac) in enumerate(valid_triples, 1):
             print(f"Triple {idx}:")
@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import time
+import numpy as np
+
+# Result modes shared by the system detectors.
+RESULT_MODES = ("all", "exists", "count", "topk")
+
+
+class TripleCollector:
+    """
+    Collect the triples found by a detector according to a result mode:
+      - "all":    keep every triple, or only the first `limit` ones if limit is set.
+      - "exists": keep the first triple and ask the detector to stop.
+      - "count":  keep no triple, only count them.
+      - "topk":   keep the `limit` highest-scoring triples in a bounded min-heap.
+    In every mode `count` is the number of triples offered (up to an early stop),
+    so memory is bounded by `limit` rather than by the number of valid triples.
+    """
+
+    def __init__(self, mode="all", limit=None):
+        if mode not in RESULT_MODES:
+            raise ValueError(f"Unknown result mode: {mode}")
+        if mode == "topk" and not limit:
+            raise ValueError("Result mode 'topk' requires a positive limit")
+        self.mode = mode
+        self.limit = limit
+        self.count = 0
+        self._triples = []
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def add_many(self, n, make_triple, scores=None):
+        """
+        Offer a batch of n triples, in detection order. make_triple(i) builds the i-th triple
+        and is only called for triples that are kept. scores() returns one score per triple
+        (higher is more suspicious); it is only evaluated in "topk" mode, so "count" stays O(1)
+        per batch. Returns True once the detector can stop searching.
+        """
+        if n == 0:
+            return False
+        if self.mode == "count":
+            self.count += n
+            return False
+
+        if self.mode == "topk":
+            self.count += n
+            batch_scores = np.asarray(scores())
+            indices = range(n)
+            if n > self.limit:
+                # Only this batch's best `limit` can make it into the global top-k.
+                indices = np.sort(np.argpartition(-batch_scores, self.limit - 1)[:self.limit])
+            for i in indices:
+                # Ties keep the earlier triple: later ones get a smaller sequence key.
+                item = (float(batch_scores[i]), -next(self._sequence), make_triple(i))
+                if len(self._heap) < self.limit:
+                    heapq.heappush(self._heap, item)
+                elif item[:2] > self._heap[0][:2]:
+                    heapq.heapreplace(self._heap, item)
+            return False
+
+        for i in range(n):
+            self.count += 1
+            self._triples.append(make_triple(i))
+            if self.mode == "exists":
+                return True
+            if self.limit is not None and len(self._triples) >= self.limit:
+                return True
+        return False
+
+    def cost(self, n):
+        """
+        Number of triples add_many examines for a batch of n, for charging a budget:
+        none in "count" mode, one in "exists", up to the remaining limit in "all".
+        """
+        if self.mode == "count":
+            return 0
+        if self.mode == "exists":
+            return min(n, 1)
+        if self.mode == "all" and self.limit is not None:
+            return min(n, max(self.limit - len(self._triples), 0))
+        return n
+
+    @property
+    def detected(self):
+        return self.count > 0
+
+    def triples(self):
+        """Kept triples: detection order, or best score first for "topk"."""
+        if self.mode == "topk":
+            return [triple for _, _, triple in sorted(self._heap, key=lambda item: item[:2], reverse=True)]
+        return list(self._triples)
+
+    def result(self):
+        """The number of triples in "count" mode, the kept triples otherwise."""
+        if self.mode == "count":
+            return self.count
+        return self.triples()
+
+
+class DetectionBudget:
+    """
+    Per-tree work limit for a detector: wall time (max_seconds) and/or the number of
+    candidate comparisons (max_comparisons). Detectors call start() when their candidate
+    search begins, so loading the tree and embedding its names (possibly loading the
+    fastText model) are not charged, then charge() as they examine candidates, and stop
+    with partial results once it returns True; callers then read `exceeded` to mark the
+    verdict as "budget exceeded".
+    """
+
+    def __init__(self, max_seconds=None, max_comparisons=None):
+        self.max_seconds = max_seconds
+        self.max_comparisons = max_comparisons
+        self.comparisons = 0
+        self.exceeded = False
+        self._deadline = None
+
+    def start(self):
+        """Start the wall-time clock, if not already running."""
+        if self.max_seconds is not None and self._deadline is None:
+            self._deadline = time.monotonic() + self.max_seconds
+
+    def charge(self, comparisons=1):
+        """Account for work done; returns True once the budget is exhausted."""
+        self.start()
+        self.comparisons += comparisons
+        if self.max_comparisons is not None and self.comparisons > self.max_comparisons:
+            self.exceeded = True
+        elif self._deadline is not None and time.monotonic() > self._deadline:
+            self.exceeded = True
+        return self.exceeded
+
+
+def check_result_arguments(parser, args):
+    """Reject --result-mode/--limit combinations TripleCollector cannot honour, before any file is read."""
+    if args.limit is not None and args.limit < 1:
+        parser.error("--limit must be positive")
+    if args.result_mode == "topk" and args.limit is None:
+        parser.error("--result-mode topk requires --limit")
+
+
+def add_budget_arguments(parser):
+    """Register the per-tree budget options shared by the detector scripts."""
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Per-tree wall-time budget; detection stops with partial results when exceeded.")
+    parser.add_argument("--max-comparisons", type=int, default=None,
+                        help="Per-tree budget of candidate comparisons; detection stops with partial results when exceeded.")
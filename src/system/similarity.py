@@ -0,0 +1,79 @@
+import numpy as np
+
+# Centered vectors whose squared norm is below this fraction of the largest raw squared
+# norm are cancellation noise, i.e. the name's vector equals the tree mean: treat as zero.
+ZERO_NORM_TOLERANCE = 1e-10
+
+
+def name_table(calls, embed):
+    """
+    Collapse the calls of a tree onto their unique function names.
+    Returns (names, name_ids, vectors, weights): names lists the unique names in order of
+    first use, name_ids[i] is the row of calls[i]'s name, vectors holds the raw embedding
+    embed(name) of each unique name, and weights is the share of calls using each name,
+    so that weights @ vectors is the mean call embedding. Calls carry no vectors of their
+    own, so per-tree embedding memory is bounded by the number of unique names.
+    """
+    rows = {}
+    counts = []
+    name_ids = np.empty(len(calls), dtype=np.int64)
+    for idx, call in enumerate(calls):
+        row = rows.get(call["function"])
+        if row is None:
+            row = rows[call["function"]] = len(counts)
+            counts.append(0)
+        counts[row] += 1
+        name_ids[idx] = row
+    vectors = np.array([embed(name) for name in rows], dtype=np.float64).reshape(len(rows), -1)
+    weights = np.array(counts, dtype=np.float64) / max(len(calls), 1)
+    return list(rows), name_ids, vectors, weights
+
+
+def centered_gram(vectors, weights):
+    """
+    Dot products between the names' vectors after subtracting the tree mean m = weights @ vectors,
+    derived from the raw Gram matrix G alone: (v_i - m).(v_j - m) = G_ij - (Gw)_i - (Gw)_j + w.Gw.
+    """
+    gram = vectors @ vectors.T
+    gram_w = gram @ weights
+    return gram - gram_w[:, None] - gram_w[None, :] + weights @ gram_w
+
+
+def _norms_from_squares(squared, vectors):
+    scale = (vectors * vectors).sum(axis=1).max(initial=0)
+    squared[squared <= ZERO_NORM_TOLERANCE * scale] = 0
+    return np.sqrt(squared)
+
+
+def centered_norms(vectors, centered):
+    """Norms of the centered vectors (the root of the centered Gram diagonal); 0 for zero vectors."""
+    return _norms_from_squares(np.diag(centered).copy(), vectors)
+
+
+def mean_centered_norms(vectors, weights):
+    """Norms of the centered vectors computed directly, for callers that do not need the Gram matrix."""
+    centered = vectors - weights @ vectors
+    return _norms_from_squares((centered * centered).sum(axis=1), vectors)
+
+
+def centered_cosines(centered, norms):
+    """Cosine similarity between every pair of centered name vectors (0 if either is zero)."""
+    safe = np.where(norms == 0, 1, norms)
+    cosines = centered / safe[:, None] / safe[None, :]
+    cosines[norms == 0, :] = 0
+    cosines[:, norms == 0] = 0
+    return cosines
+
+
+def keyword_cosines(dots, weights, norms, keyword_norms):
+    """
+    Cosine similarity between each centered name vector and each raw keyword vector,
+    from the raw dots (names x keywords): (v_i - m).k = v_i.k - weights @ (V.k).
+    """
+    centered_dots = dots - weights @ dots
+    safe = np.where(norms == 0, 1, norms)
+    safe_keywords = np.where(keyword_norms == 0, 1, keyword_norms)
+    cosines = centered_dots / safe[:, None] / safe_keywords[None, :]
+    cosines[norms == 0, :] = 0
+    cosines[:, keyword_norms == 0] = 0
+    return cosines
@@ -0,0 +1,13 @@
+def walk_preorder(tree):
+    """
+    Yield (node, order, depth) for every node of an action tree in preorder, the root having
+    order 1 and depth 1. Iterative, so deep trees do not hit the recursion limit, and the
+    numbering is local to each call: no counter has to be reset between trees.
+    """
+    stack = [(tree, 1)]
+    order = 0
+    while stack:
+        node, depth = stack.pop()
+        order += 1
+        yield node, order, depth
+        stack.extend((child, depth + 1) for child in reversed(node.get("nodes", [])))
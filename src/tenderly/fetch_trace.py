@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import os
+import sys
 import argparse
 import json
 import requests
 from tqdm import tqdm
 
+# Add the src folder to the path for the shared JSON codec.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import json_codec
+
 def trace_transaction(tenderly_node_access_key, transaction_hash):
     url = f"https://mainnet.gateway.tenderly.co/{tenderly_node_access_key}" 
     headers = {
@@ -49,9 +54,8 @@ def main(tenderly_node_access_key, input_folder_path, output_folder_path):
         # Read the file (if needed, e.g., validation) or simply use the file name as the hash.
         input_file_path = os.path.join(input_folder_path, filename)
         try:
-            with open(input_file_path, 'r') as f:
-                # Optionally, validate the JSON content if needed.
-                _ = json.load(f)
+            # Optionally, validate the JSON content if needed.
+            _ = json_codec.load(input_file_path)
         except Exception as e:
             print(f"Could not read or validate file {input_file_path}: {e}")
         
@@ -61,8 +65,7 @@ def main(tenderly_node_access_key, input_folder_path, output_folder_path):
             # Save the trace_result to the output folder as "{transaction_hash}.json"
             output_file_path = os.path.join(output_folder_path, f"{transaction_hash}.json")
             try:
-                with open(output_file_path, 'w') as out_file:
-                    json.dump(trace_result, out_file, indent=2)
+                json_codec.dump(trace_result, output_file_path, indent=2)
             except Exception as e:
                 print(f"Error writing file {output_file_path}: {e}")
 
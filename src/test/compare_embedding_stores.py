@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+from glob import glob
+
+# Add the parent directory's "system" folder to the path so we can import the detectors.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'system'))
+# ... and the src folder for the shared JSON codec, after it so the system detectors win.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import poma
+import reentrancy
+import json_codec
+from embedding_store import EmbeddingStore, Embedder
+
+DETECTORS = {
+    "reentrancy": (reentrancy, lambda calls, embedder: bool(reentrancy.detect_reentrancy(calls, mode="exists",
+                                                                                         embedder=embedder))),
+    "poma": (poma, lambda calls, embedder: poma.detect_poma(calls, mode="exists", embedder=embedder)[0]),
+}
+
+
+def run_store(store_path, file_paths, ignore_static_delegate):
+    """
+    Run both system detectors over file_paths using the embedding store at store_path.
+    Meant to run in a fresh process, so that the reported peak RSS only covers this store.
+    Returns the per-detector verdicts, the detection time and the peak RSS.
+    """
+    embedder = Embedder.from_path(store_path)
+    store = embedder.store
+
+    verdicts = {name: {} for name in DETECTORS}
+    seconds = 0.0
+    for file_path in file_paths:
+        tx_hash = os.path.splitext(os.path.basename(file_path))[0]
+        for name, (module, detect) in DETECTORS.items():
+            tree = json_codec.load(file_path)
+            start = time.perf_counter()
+            calls = module.collect_calls(tree, ignore_static_delegate=ignore_static_delegate)
+            verdicts[name][tx_hash] = bool(detect(calls, embedder))
+            seconds += time.perf_counter() - start
+
+    return {
+        "verdicts": verdicts,
+        "seconds": seconds,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "store_bytes": store.nbytes if store is not None else 0,
+        "dim": store.dim if store is not None else None,
+    }
+
+
+def agreement(reference, candidate):
+    """Fraction of transactions with the same verdict, and the flips in each direction."""
+    same = sum(reference[tx] == candidate[tx] for tx in reference)
+    lost = sum(reference[tx] and not candidate[tx] for tx in reference)
+    gained = sum(candidate[tx] and not reference[tx] for tx in reference)
+    return same / max(len(reference), 1), lost, gained
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare compact embedding stores (see system/embedding_store.py compact) against a reference store: "
+                    "verdict agreement of the reentrancy and POMA detectors, detection time, and peak RSS.")
+    parser.add_argument("--input-path", nargs='+', required=True,
+                        help="Folder(s) of action tree JSON files, e.g. the reentrancy and POMA datasets")
+    parser.add_argument("--reference-store", required=True, help="Full-precision embedding store")
+    parser.add_argument("--candidate-stores", nargs='+', required=True, help="Compact embedding stores to evaluate")
+    parser.add_argument("--ignore-static-delegate", action="store_true",
+                        help="Ignore nodes with 'staticcall' or 'delegatecall' during traversal.")
+    parser.add_argument("--output-file", default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    for store_path in [args.reference_store] + args.candidate_stores:
+        if EmbeddingStore.open(store_path) is None:
+            parser.error(f"No embedding store at {store_path}")
+
+    file_paths = sorted(file_path for input_path in args.input_path
+                        for file_path in glob(os.path.join(input_path, "*.json")))
+
+    # One spawned process per store, so neither memory nor caches leak between runs.
+    context = multiprocessing.get_context("spawn")
+    runs = {}
+    for store_path in [args.reference_store] + args.candidate_stores:
+        with context.Pool(1) as pool:
+            runs[store_path] = pool.apply(run_store, (store_path, file_paths, args.ignore_static_delegate))
+        print(f"Evaluated {store_path} on {len(file_paths)} files")
+
+    reference = runs[args.reference_store]
+    report = []
+    print(f"\n{'store':<40} {'dim':>4} {'MiB':>8} {'seconds':>8} {'RSS MiB':>8}  agreement (lost/gained detections)")
+    for store_path, run in runs.items():
+        row = {
+            "store": store_path,
+            "dim": run["dim"],
+            "store_mib": run["store_bytes"] / 2**20,
+            "seconds": run["seconds"],
+            "max_rss_mib": run["max_rss_kb"] / 1024,
+            "agreement": {},
+        }
+        for name in DETECTORS:
+            share, lost, gained = agreement(reference["verdicts"][name], run["verdicts"][name])
+            row["agreement"][name] = {"share": share, "lost": lost, "gained": gained}
+        summary = ", ".join(f"{name} {values['share']:.1%} ({values['lost']}/{values['gained']})"
+                            for name, values in row["agreement"].items())
+        print(f"{store_path:<40} {row['dim']:>4} {row['store_mib']:>8.2f} {row['seconds']:>8.2f} "
+              f"{row['max_rss_mib']:>8.1f}  {summary}")
+        report.append(row)
+
+    if args.output_file:
+        json_codec.dump(report, args.output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,94 @@
 #!/usr/bin/env python3
 import os
-import glob
-import subprocess
+import sys
 import argparse
-from tqdm import tqdm
+from glob import glob
+
+# Add the parent directory's "moe" folder to the path so we can import poma.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'moe'))
+# ... and the src folder for the shared scheduling and sharding helpers.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scheduler import largest_first, file_size_or_zero, run_forked
+from tree_loader import load_tree, run_prefetched, add_loader_arguments
+from sharding import in_shard, tx_hash_of, add_shard_arguments, check_shard_arguments, write_shard_verdicts
+from poma import collect_transfers, form_transacts, detect_price_manipulation
+
+
+def process_file(file_path, tree=None):
+    """
+    Load one action tree (unless it is passed in, already loaded by a prefetching loader),
+    form its transacts and run the MoE price manipulation detector on them in this process.
+    Returns (detected, triple) as detect_price_manipulation does.
+    """
+    if tree is None:
+        tree = load_tree(file_path)
+    return detect_price_manipulation(form_transacts(collect_transfers(tree)))
+
+
+def judge_file(file_path, tree=None):
+    """Reduce process_file's outcome to a verdict: "detected" or "not_detected"."""
+    detected, _ = process_file(file_path, tree)
+    return "detected" if detected else "not_detected"
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Run price manipulation detection on each JSON file under output/poma/actiontree/ and report progress."
+        description="Run the MoE price manipulation detector (moe/poma.py) on every JSON action tree in a folder "
+                    "and report progress. Files are processed in-process, optionally on several forked workers."
     )
+    parser.add_argument("--input-path", required=True, help="Folder path containing JSON files to process")
     parser.add_argument(
         "--verbose", "-v", action="store_true",
         help="Enable verbose output showing transaction hash for each detected price manipulation."
     )
+    parser.add_argument("--order", choices=["listing", "largest-first"], default="listing",
+                        help="Process files in directory order or largest tree first.")
+    parser.add_argument("--results-file", default=None,
+                        help="Write this run's per-transaction verdicts as JSON (mergeable with merge_shards.py).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of forked detector processes (default: 1, run in this process).")
+    add_loader_arguments(parser)
+    add_shard_arguments(parser)
     args = parser.parse_args()
-    verbose = args.verbose
+    check_shard_arguments(parser, args)
 
-    # Folder containing JSON action tree files.
-    json_dir = "/mnt/bigdata/txnanalyzer/output/poma/actiontree/"
-    pattern = os.path.join(json_dir, "*.json")
-    json_files = glob.glob(pattern)
+    json_files = [json_file for json_file in glob(os.path.join(args.input_path, "*.json"))
+                  if in_shard(tx_hash_of(json_file), args.shard_index, args.num_shards)]
+    if args.order == "largest-first":
+        json_files = largest_first(json_files, file_size_or_zero)
     total_files = len(json_files)
 
     # Counters for statistics.
     detected_count = 0
     nondetected_count = 0
     error_count = 0
+    verdicts = {"detected": [], "not_detected": [], "errors": []}
 
-    print(f"Processing {total_files} JSON files in '{json_dir}'...")
-
-    # Process each file with a progress bar.
-    for json_file in tqdm(json_files, desc="Processing files", unit="file"):
-        cmd = ["python", "src/moe/poma.py", "--input-file", json_file]
-        try:
-            result = subprocess.run(
-                cmd, capture_output=True, text=True, check=True)
-            stdout = result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            print(f"\nError processing file {json_file}: {e}")
+    print(f"Processing {total_files} JSON files in '{args.input_path}'...")
+
+    if args.workers > 1:
+        # Results come back in file order, so the verdict lists do not depend on the worker count.
+        outcomes = run_forked(judge_file, json_files, args.workers, total=total_files,
+                              desc="Processing files", unit="file", ordered=True)
+    else:
+        # In-process: the next trees are read and decoded while the detector runs on this one.
+        outcomes = run_prefetched(judge_file, json_files, args.prefetch_depth, args.loader_threads,
+                                  total=total_files, desc="Processing files", unit="file")
+    for json_file, verdict, error in outcomes:
+        tx_hash = tx_hash_of(json_file)
+        if error is not None:
+            print(f"\nError processing file {json_file}: {error}")
             error_count += 1
+            verdicts["errors"].append(tx_hash)
             continue
-
-        if "Price Manipulation detected!" in stdout:
+        verdicts[verdict].append(tx_hash)
+        if verdict == "detected":
             detected_count += 1
-            if verbose:
-                # Assuming the transaction hash is the filename without its extension.
-                tx_hash = os.path.splitext(os.path.basename(json_file))[0]
-                print(
-                    f"\nPrice manipulation detected in transaction: {tx_hash}")
-        elif "No price manipulation detected." in stdout:
-            nondetected_count += 1
+            if args.verbose:
+                print(f"\nPrice manipulation detected in transaction: {tx_hash}")
         else:
-            error_count += 1
+            nondetected_count += 1
 
     # Print summary statistics.
     print("\n=== Processing Completed ===")
@@ -61,6 +97,9 @@ def main():
     print(f"  - No price manipulation detected: {nondetected_count}")
     print(f"  - Errors encountered: {error_count}")
 
+    if args.results_file:
+        write_shard_verdicts(args.results_file, args.shard_index, args.num_shards, verdicts)
+
 
 if __name__ == "__main__":
     main()
@@ -1,47 +1,46 @@
 #!/usr/bin/env python3
 import os
-import json
+from functools import partial
 import argparse
 from glob import glob
-from tqdm import tqdm
+import logging
 
 import sys
 # Add the parent directory's "system" folder to the path so we can import reentrancy.py
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'system'))
+# ... and the src folder for the shared scheduling and sharding helpers.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from reentrancy import traverse_tree, adjust_embeddings, detect_reentrancy
+from scheduler import largest_first, file_size_or_zero, run_forked
+from tree_loader import load_tree, run_prefetched, add_loader_arguments
+from sharding import in_shard, tx_hash_of, add_shard_arguments, check_shard_arguments, write_shard_verdicts
+from reentrancy import collect_calls, detect_reentrancy
+from results import RESULT_MODES, DetectionBudget, add_budget_arguments, check_result_arguments
+from embedding_store import Embedder, DEFAULT_STORE_PATH, prepare_forked_embedder, add_preload_arguments
 
-def reset_reentrancy_globals():
-    """
-    Reset the globals used in reentrancy.py by modifying the globals() dict of one of its functions.
-    This avoids directly importing the global variables.
-    """
-    globals_map = traverse_tree.__globals__
-    globals_map['order_counter'] = 1
-    globals_map['embedding_cache'] = {}
-
-def process_file(file_path, ignore_static_delegate=False, verbose=False):
+def process_file(file_path, embedder, ignore_static_delegate=False, verbose=False, mode="exists", limit=None,
+                 budget=None, tree=None):
     """
     Process a single JSON file:
-      - Loads the JSON file.
-      - Resets the globals (order_counter and embedding_cache) used by the reentrancy functions.
-      - Traverses the tree, adjusts embeddings, and detects reentrancy.
+      - Loads the JSON file, unless its tree is passed in (already loaded by a prefetching loader).
+      - Traverses the tree and detects reentrancy, embedding names with embedder (an embedding_store.Embedder,
+        shared across files so vectors are reused instead of recomputed for every tree).
+        mode/limit are passed to detect_reentrancy: "exists" stops at the first triple, which is all a
+        yes/no verdict needs; "all", "count" and "topk" return more detail.
+        budget (a DetectionBudget) caps the detector's work; check budget.exceeded afterwards.
       - If verbose mode is enabled, prints the valid reentrancy triples.
-    Returns the valid triples found.
+    Returns the valid triples found, or their number in "count" mode.
     """
-    with open(file_path, "r") as f:
-        tree = json.load(f)
-    
-    # Reset globals for this file's processing.
-    reset_reentrancy_globals()
+    if tree is None:
+        tree = load_tree(file_path)
 
-    calls = []
-    traverse_tree(tree, depth=1, calls=calls, ignore_static_delegate=ignore_static_delegate)
-    adjust_embeddings(calls)
-    valid_triples = detect_reentrancy(calls)
+    calls = collect_calls(tree, ignore_static_delegate=ignore_static_delegate)
+    valid_triples = detect_reentrancy(calls, mode=mode, limit=limit, budget=budget, embedder=embedder)
 
     if verbose:
-        if valid_triples:
+        if valid_triples and mode == "count":
+            print(f"File: {file_path} - {valid_triples} valid reentrancy triples found.")
+        elif valid_triples:
             print(f"File: {file_path} - Valid reentrancy triples found:")
             for idx, (call_A, call_B, call_C, sim_ab, sim_ac) in enumerate(valid_triples, 1):
                 print(f"  Triple {idx}:")
@@ -58,10 +57,26 @@ def process_file(file_path, ignore_static_delegate=False, verbose=False):
             print(f"File: {file_path} - No valid reentrancy triples found.")
     return valid_triples
 
+def judge_file(file_path, embedder, ignore_static_delegate=False, verbose=False, mode="exists", limit=None,
+               max_seconds=None, max_comparisons=None, tree=None):
+    """
+    Run process_file under a fresh per-tree budget and reduce the outcome to a verdict:
+    "detected", "not_detected", or "budget_exceeded" when nothing was found before the
+    budget ran out. Returns (verdict, comparisons charged to the budget).
+    """
+    budget = DetectionBudget(max_seconds, max_comparisons)
+    valid_triples = process_file(file_path, embedder, ignore_static_delegate=ignore_static_delegate,
+                                 verbose=verbose, mode=mode, limit=limit, budget=budget, tree=tree)
+    if valid_triples:
+        return "detected", budget.comparisons
+    if budget.exceeded:
+        # Nothing found before the budget ran out: inconclusive rather than clean.
+        return "budget_exceeded", budget.comparisons
+    return "not_detected", budget.comparisons
+
 def main():
     import argparse
     from glob import glob
-    from tqdm import tqdm
     import os
 
     parser = argparse.ArgumentParser(
@@ -73,29 +88,74 @@ def main():
                         help="Ignore nodes with 'staticcall' or 'delegatecall' during traversal.")
     parser.add_argument("-v", "--verbose", action="store_true",
                         help="Print valid reentrancy triples for each file.")
+    parser.add_argument("--order", choices=["listing", "largest-first"], default="listing",
+                        help="Process files in directory order or largest tree first.")
+    parser.add_argument("--result-mode", choices=RESULT_MODES, default="exists",
+                        help="Detector result mode: stop at the first triple (exists, default), list all, count, or top-k by score.")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Maximum number of triples kept per file ('all' and 'topk' modes).")
+    parser.add_argument("--results-file", default=None,
+                        help="Write this run's per-transaction verdicts as JSON (mergeable with merge_shards.py).")
+    parser.add_argument("--embedding-store", default=DEFAULT_STORE_PATH,
+                        help="Pre-computed action-name embeddings (built with system/embedding_store.py).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of forked detector processes (default: 1, run in this process).")
+    add_preload_arguments(parser)
+    add_budget_arguments(parser)
+    add_loader_arguments(parser)
+    add_shard_arguments(parser)
     args = parser.parse_args()
+    check_shard_arguments(parser, args)
+    check_result_arguments(parser, args)
+    embedder = Embedder.from_path(args.embedding_store)
+    prepare_forked_embedder(embedder, args.workers, preload=not args.no_preload_model)
 
-    file_paths = glob(os.path.join(args.input_path, "*.json"))
+    file_paths = [file_path for file_path in glob(os.path.join(args.input_path, "*.json"))
+                  if in_shard(tx_hash_of(file_path), args.shard_index, args.num_shards)]
+    if args.order == "largest-first":
+        file_paths = largest_first(file_paths, file_size_or_zero)
     total_files = len(file_paths)
     reentrancy_detected_count = 0
     no_reentrancy_count = 0
     error_count = 0
+    budget_exceeded_count = 0
+    verdicts = {"detected": [], "not_detected": [], "budget_exceeded": [], "errors": []}
 
-    for file_path in tqdm(file_paths, desc="Processing JSON files", unit="file"):
-        try:
-            valid_triples = process_file(file_path, ignore_static_delegate=args.ignore_static_delegate, verbose=args.verbose)
-            if valid_triples:
-                reentrancy_detected_count += 1
-            else:
-                no_reentrancy_count += 1
-        except Exception as e:
+    judge = partial(judge_file, embedder=embedder, ignore_static_delegate=args.ignore_static_delegate,
+                    verbose=args.verbose, mode=args.result_mode, limit=args.limit,
+                    max_seconds=args.max_seconds, max_comparisons=args.max_comparisons)
+    if args.workers > 1:
+        # Results come back in file order, so the verdict lists do not depend on the worker count.
+        outcomes = run_forked(judge, file_paths, args.workers, total=total_files,
+                              desc="Processing JSON files", unit="file", ordered=True)
+    else:
+        # In-process: the next trees are read and decoded while the detector runs on this one.
+        outcomes = run_prefetched(judge, file_paths, args.prefetch_depth, args.loader_threads, total=total_files,
+                                  desc="Processing JSON files", unit="file")
+    for file_path, outcome, error in outcomes:
+        if error is not None:
             error_count += 1
+            verdicts["errors"].append(tx_hash_of(file_path))
+            continue
+        verdict, comparisons = outcome
+        verdicts[verdict].append(tx_hash_of(file_path))
+        if verdict == "detected":
+            reentrancy_detected_count += 1
+        elif verdict == "budget_exceeded":
+            budget_exceeded_count += 1
+            logging.warning("Budget exceeded for %s after %d comparisons", file_path, comparisons)
+        else:
+            no_reentrancy_count += 1
 
     print("\n=== Processing Completed ===")
     print(f"Total JSON files processed: {total_files}")
     print(f"  - Reentrancy detected: {reentrancy_detected_count}")
     print(f"  - No reentrancy found: {no_reentrancy_count}")
+    print(f"  - Budget exceeded (inconclusive): {budget_exceeded_count}")
     print(f"  - Errors encountered: {error_count}")
 
+    if args.results_file:
+        write_shard_verdicts(args.results_file, args.shard_index, args.num_shards, verdicts)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
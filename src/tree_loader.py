@@ -0,0 +1,132 @@
+import time
+import collections
+import concurrent.futures
+from tqdm import tqdm
+
+import json_codec
+
+# Number of trees read and decoded ahead of the detector.
+DEFAULT_PREFETCH_DEPTH = 4
+
+
+def load_tree(file_path):
+    """Read and decode one action tree JSON file."""
+    return json_codec.load(file_path)
+
+
+class LoaderStats:
+    """
+    Time spent loading trees in the background (load_seconds) and time the
+    consumer spent blocked waiting for the next tree (wait_seconds). A wait
+    close to zero means loading is fully hidden behind detection.
+    """
+
+    def __init__(self):
+        self.trees = 0
+        self.load_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def summary(self, elapsed):
+        share = self.wait_seconds / max(elapsed, 1e-9)
+        return (f"waited {self.wait_seconds:.2f}s on tree loading ({share:.1%} of {elapsed:.1f}s); "
+                f"loading {self.trees} trees took {self.load_seconds:.2f}s")
+
+
+def _timed_load(file_path):
+    start = time.perf_counter()
+    try:
+        tree, error = load_tree(file_path), None
+    except Exception as e:
+        tree, error = None, e
+    return tree, error, time.perf_counter() - start
+
+
+def prefetch_trees(file_paths, depth=DEFAULT_PREFETCH_DEPTH, threads=1, stats=None):
+    """
+    Yield (file_path, tree, error) in the order of file_paths, while the next
+    `depth` trees are read and decoded by `threads` background threads. At most
+    depth trees are buffered beyond the one being consumed, so memory stays
+    bounded however many files there are. error is the exception raised while
+    loading the file, or None. With depth <= 0 every tree is loaded on demand.
+
+    Disk reads overlap fully with detection; decoding holds the GIL, so extra
+    threads mostly help on slow or remote storage. stats (a LoaderStats) is
+    updated with the load time and the time the consumer waited.
+    """
+    stats = stats if stats is not None else LoaderStats()
+    if depth <= 0:
+        for file_path in file_paths:
+            tree, error, seconds = _timed_load(file_path)
+            stats.trees += 1
+            stats.load_seconds += seconds
+            stats.wait_seconds += seconds
+            yield file_path, tree, error
+        return
+
+    path_iter = iter(file_paths)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+
+        def refill():
+            while len(pending) < depth:
+                try:
+                    file_path = next(path_iter)
+                except StopIteration:
+                    return
+                pending.append((file_path, executor.submit(_timed_load, file_path)))
+
+        try:
+            refill()
+            while pending:
+                file_path, future = pending.popleft()
+                start = time.perf_counter()
+                tree, error, seconds = future.result()
+                stats.wait_seconds += time.perf_counter() - start
+                stats.trees += 1
+                stats.load_seconds += seconds
+                # Queue the next load before handing this tree to the consumer.
+                refill()
+                yield file_path, tree, error
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def run_prefetched(fn, file_paths, depth=DEFAULT_PREFETCH_DEPTH, threads=1, total=None, desc="Processing",
+                   unit="file"):
+    """
+    Run fn(file_path, tree=tree) over the trees of file_paths in this process,
+    loading them ahead with prefetch_trees so that reading and decoding the
+    next files overlaps with fn on the current one.
+
+    Yields (file_path, result, error) in file order, like run_forked with
+    ordered set; a file that fails to load is yielded with its load error.
+    Throughput and the time spent waiting on I/O are printed at the end.
+    """
+    stats = LoaderStats()
+    start_time = time.time()
+
+    with tqdm(total=total, desc=desc, unit=unit) as pbar:
+        for file_path, tree, error in prefetch_trees(file_paths, depth, threads, stats):
+            result = None
+            if error is None:
+                try:
+                    result = fn(file_path, tree=tree)
+                except Exception as e:
+                    error = e
+            pbar.update(1)
+            yield file_path, result, error
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    if stats.trees:
+        print(f"{desc}: {stats.trees} {unit} in {elapsed:.1f}s ({stats.trees / elapsed:.2f} {unit}/s)")
+        print(f"{desc}: {stats.summary(elapsed)} (prefetch depth {depth}, {threads} loader thread(s))")
+
+
+def add_loader_arguments(parser):
+    """Register the tree prefetching options shared by the batch scripts."""
+    parser.add_argument("--prefetch-depth", type=int, default=DEFAULT_PREFETCH_DEPTH,
+                        help="Trees read and decoded ahead of the detector when running in-process "
+                             f"(default: {DEFAULT_PREFETCH_DEPTH}; 0 loads each tree on demand).")
+    parser.add_argument("--loader-threads", type=int, default=1,
+                        help="Background threads loading trees ahead (default: 1).")
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import json
+import json_codec
 import argparse
 
 order_counter = 1
@@ -61,8 +61,7 @@ def main():
                         default=[], help="List of 'call_type' values to exclude from visualization")
     args = parser.parse_args()
 
-    with open(args.input_file, "r") as f:
-        tree = json.load(f)
+    tree = json_codec.load(args.input_file)
 
     global order_counter
     order_counter = 1  # Reset counter before annotating